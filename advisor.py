@@ -0,0 +1,110 @@
+"""
+Optimal input advice for any race state.
+
+The transitions repeat every 16 frames, i.e. every 8 time steps, so one set
+of tables covers all start offsets. For a state i at time step j with phase
+q = (j + offset) % 8, V[q, i, h] is the largest distance covered in the next
+h time steps and row (h-1)*8 + q of the packed policy A holds the first input
+of such a run. V grows with h, so the earliest finish from state i with
+distance x is the smallest h with x + V[q, i, h] >= FINISH, and the optimal
+input is the policy for that h.
+
+The tables are built once (`python3 advisor.py`) and memory-mapped by the web
+app. A lookup reads one value row and one policy byte.
+"""
+
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+import policy
+from mintime import FINISH
+from trans import m, inputs, idx, frm, phase, states, load_tables as load_trans, VERSION
+
+
+# largest number of remaining time steps (finish times up to 5.87 from race start)
+HMAX = 176
+
+# Advice record
+#   th:        optimal throttle input (of time step j+1)
+#   cl:        optimal clutch input (of time step j+1)
+#   finish:    earliest finish time step (None if not within HMAX time steps)
+Advice = namedtuple('Advice', ['th', 'cl', 'finish'])
+
+
+def tables_path(datadir='data'):
+    """Paths of the value and policy tables"""
+    return Path(datadir) / f"advice_values_v{VERSION}.npy", Path(datadir) / f"advice_policy_v{VERSION}.npy"
+
+def build_tables(datadir='data', hmax=HMAX, verbose=0):
+    """Computes the value tables V[q, i, h] and the policy rows A[(h-1)*8 + q] (saved to datadir)"""
+    T = load_trans(datadir)
+    v = states()[3]
+    vpath, apath = tables_path(datadir)
+    vtmp, atmp = vpath.with_suffix('.tmp.npy'), apath.with_suffix('.tmp.npy')
+    V = np.lib.format.open_memmap(vtmp, mode='w+', dtype=np.uint16, shape=(8, m, hmax+1))
+    A = policy.alloc(8*hmax, m, atmp)
+    # distances of the previous h (-1 for the 'busted' sink state m-1)
+    Vprev = np.zeros((8, m), dtype=np.int32)
+    Vprev[:, m-1] = -1
+    for h in range(1, hmax+1):
+        if verbose > 0 and h % 16 == 0:
+            print(f"h = {h}")
+        Vh = np.full((8, m), -1, dtype=np.int32)
+        for q in range(8):
+            Qu = Vprev[(q+1) % 8][T[phase(frm(q+1, 0)), :, :m-1]]
+            amax = np.argmax(Qu, axis=0)  # first maximum (same tie breaking as dprog.py)
+            policy.pack(amax, out=A[8*(h-1)+q])
+            Vh[q, :m-1] = v + np.take_along_axis(Qu, amax[None, :], axis=0)[0]
+        V[:, :, h] = np.maximum(Vh, 0)
+        Vprev = Vh
+    V.flush()
+    A.flush()
+    del V, A
+    vtmp.replace(vpath)
+    atmp.replace(apath)
+
+def load_tables(datadir='data'):
+    """Load the (memory-mapped) value and policy tables (None if not built)"""
+    vpath, apath = tables_path(datadir)
+    if not vpath.exists() or not apath.exists():
+        return None
+    return np.load(vpath, mmap_mode='r'), np.load(apath, mmap_mode='r')
+
+def advise(tables, ofs, j, x, s):
+    """Optimal input of time step j+1 and earliest finish from state s = (c, y, r, v) with distance x at time step j"""
+    V, A = tables
+    hmax = V.shape[2]-1
+    q = (j + ofs) % 8
+    i = idx(s)
+    h = int(np.searchsorted(V[q, i], max(FINISH - x, 1)))  # first h with x + V[q, i, h] >= FINISH
+    finish = j + h if h <= hmax else None
+    th, cl = inputs[policy.get(A, 8*(min(h, hmax)-1) + q, i)]
+    return Advice(th, cl, finish)
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from time import perf_counter
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description="Build the optimal input advice tables of the web app.")
+    parser.add_argument("--datadir", default="data", help="Output directory.")
+    parser.add_argument("--hmax", type=int, default=HMAX, help="Largest number of remaining time steps.")
+    args = parser.parse_args()
+
+    tbeg = perf_counter()
+    build_tables(args.datadir, args.hmax, verbose=1)
+    vpath, apath = tables_path(args.datadir)
+    print(f"Wrote advice tables '{vpath}' and '{apath}' ({perf_counter()-tbeg:.1f}s).")
+
+    # finish times from the start states (as computed by mintime.py)
+    tables = load_tables(args.datadir)
+    print("ofs  c  r   steps")
+    print("-----------------")
+    for ofs in range(8):
+        c, r = min(((c, r) for c in range(2) for r in range(0, 32, 3)),
+                   key=lambda x: advise(tables, ofs, 0, 0, (x[0], 0, x[1], 0)).finish or np.inf)
+        print(f"{ofs:<3d}  {c}  {r:2d}  {advise(tables, ofs, 0, 0, (c, 0, r, 0)).finish}")
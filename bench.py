@@ -0,0 +1,269 @@
+"""
+Benchmarks of the simulator, the solvers, the dump parser and the web app.
+
+All benchmarks run on fixed inputs (seeded random data and the minimum-time
+solution of `mintime.py`) in a temporary working directory. The results are
+written as JSON and can be compared with a stored baseline, flagging
+regressions beyond a tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import zlib
+
+from collections import namedtuple
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+
+import numpy as np
+
+
+# repository directory (scripts and templates)
+REPO = Path(__file__).resolve().parent
+
+# seed of all random data
+SEED = 1980
+
+ROMNAME = "Dragster (1980) (Activision)"
+
+# Metric record
+#   value:     measured value
+#   unit:      unit of the value
+#   better:    'lower' or 'higher'
+Metric = namedtuple('Metric', ['value', 'unit', 'better'])
+
+
+def timeit(fn, mintime=0.5, repeat=5):
+    """Median wall time of fn() (repeated at least `repeat` times and for `mintime` seconds)"""
+    times = []
+    tbeg = perf_counter()
+    while len(times) < repeat or perf_counter()-tbeg < mintime:
+        t0 = perf_counter()
+        fn()
+        times.append(perf_counter()-t0)
+    return median(times)
+
+def run(args, cwd):
+    """Run a Python script, returns its output, wall time and peak RSS (in MB)"""
+    t0 = perf_counter()
+    proc = subprocess.Popen([sys.executable, *map(str, args)], cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    out = proc.stdout.read()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    t = perf_counter()-t0
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(map(str, args))} failed:\n{out}")
+    return out, t, rusage.ru_maxrss/1024
+
+def race_inputs(workdir):
+    """Per-frame inputs (th, cl) of the minimum-time race for offset 0"""
+    import mintime
+    from trans import load_tables
+    res = mintime.solve(0, T=load_tables(workdir / 'data'))
+    return list(islice(mintime.mintimegen(0, res.x0, res.u), 520))
+
+def png(pixels):
+    """PNG file contents of an RGB image"""
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+    height, width, _ = pixels.shape
+    raw = b''.join(b'\x00' + row.tobytes() for row in pixels.astype(np.uint8))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+def write_dump(path, nframes, rng):
+    """Write a Stella dump file of nframes random RAM snapshots (with a proper frame counter)"""
+    ram = rng.integers(0, 256, size=(nframes, 128))
+    ram[:, 0x01] = np.arange(nframes) & 0xFF
+    lines = []
+    for f in range(nframes):
+        for row in range(8):
+            b = ram[f, 16*row:16*row+16]
+            lines.append(f"{0x80+16*row:02x}: " + " ".join(f"{x:02x}" for x in b[:8]) + " - " + " ".join(f"{x:02x}" for x in b[8:]))
+        lines.append("A=00 X=01 Y=02 S=ff PC=f29a nv-bdizc")
+        lines.append(" ".join(f"{x:02x}" for x in rng.integers(0, 256, size=20)))
+    path.write_text("\n".join(lines) + "\n")
+
+
+def bench_sim(workdir):
+    from sim import sim
+    u = race_inputs(workdir)
+    nframes = sum(1 for _ in sim(iter(u)))
+    t = timeit(lambda: sum(1 for _ in sim(iter(u))))
+    return {'sim.frames_per_sec': Metric(nframes/t, 'frames/s', 'higher')}
+
+def bench_sim_batch(workdir):
+    from sim import sim_batch
+    rng = np.random.default_rng(SEED)
+    u = np.array(race_inputs(workdir), dtype=np.int32)
+    # perturbed race inputs (1% of the inputs toggled)
+    lanes = np.tile(u, (256, 1, 1))
+    lanes ^= (rng.random(lanes.shape) < 0.01).astype(np.int32)
+    t = timeit(lambda: sim_batch(lanes))
+    return {'sim_batch.frames_per_sec': Metric(lanes.shape[0]*lanes.shape[1]/t, 'frames/s', 'higher')}
+
+def bench_dprog(workdir):
+    # time per backward step from the difference of a short and a long run (excluding start-up)
+    n1, n2 = 8, 88
+    _, t1, _ = run([REPO / 'dprog.py', '--nsteps', n1, '--no-store'], workdir)
+    _, t2, rss = run([REPO / 'dprog.py', '--nsteps', n2, '--no-store'], workdir)
+    return {
+        'dprog.step_seconds': Metric((t2-t1)/(n2-n1), 's', 'lower'),
+        'dprog.peak_rss': Metric(rss, 'MB', 'lower'),
+    }
+
+def bench_optim(workdir):
+    builds = []
+    for _ in range(3):
+        out, _, _ = run([REPO / 'optim.py', '--nsteps', 177, '--write', workdir / 'dragster.lp'], workdir)
+        builds.append(float(re.search(r"Model build: ([0-9.]+)s", out).group(1)))
+    return {'optim.build_seconds': Metric(median(builds), 's', 'lower')}
+
+def bench_parse_dump(workdir):
+    from sim import dump_path, parse_dump
+    rng = np.random.default_rng(SEED)
+    write_dump(workdir / 'data' / f"{ROMNAME}_dbg_bench.dump", 2000, rng)
+    size = dump_path(ROMNAME, 'bench', workdir / 'data').stat().st_size
+    t = timeit(lambda: parse_dump(ROMNAME, 'bench', cache=False, datadir=workdir / 'data'))
+    return {'parse_dump.mb_per_sec': Metric(size/t/(1 << 20), 'MB/s', 'higher')}
+
+def bench_plot(workdir):
+    rng = np.random.default_rng(SEED)
+    nframes = 300
+    write_dump(workdir / 'data' / f"{ROMNAME}_dbg_plot.dump", nframes, rng)
+    # frame images: static background with a moving sprite and a few distinct backgrounds
+    backgrounds = rng.integers(0, 256, size=(4, 210, 160, 3))
+    for f in range(nframes):
+        img = backgrounds[(f // 100) % len(backgrounds)].copy()
+        img[100:110, (f % 150):(f % 150)+10] = 255
+        (workdir / 'data' / f"{ROMNAME}_dbg_plot_{f:04d}.png").write_bytes(png(img))
+    shutil.copytree(REPO / 'templates', workdir / 'templates', dirs_exist_ok=True)
+    _, t, _ = run([REPO / 'plot.py', 'plot'], workdir)
+    return {'plot.seconds': Metric(t, 's', 'lower')}
+
+def bench_flask(workdir):
+    import dragster
+    rng = np.random.default_rng(SEED)
+    client = dragster.app.test_client()
+    t_index = timeit(lambda: client.get('/'), repeat=20)
+    def toggle(frame):
+        res = client.post('/u', json={'toggles': [{'type': 'th', 'frame': frame}]})
+        if res.status_code != 200:
+            raise RuntimeError(f"/u failed with status {res.status_code}")
+    # toggle distinct random odd frames (and restore the inputs, not measured), so that no timed
+    # toggle is served from the results cache
+    times = []
+    for frame in rng.choice(np.arange(201, 480, 2), size=50, replace=False):
+        t0 = perf_counter()
+        toggle(int(frame))
+        times.append(perf_counter()-t0)
+        toggle(int(frame))
+    t_u = median(times)
+    return {
+        'flask.index_ms': Metric(1000*t_index, 'ms', 'lower'),
+        'flask.u_ms': Metric(1000*t_u, 'ms', 'lower'),
+    }
+
+
+BENCHMARKS = {
+    'sim': bench_sim,
+    'sim_batch': bench_sim_batch,
+    'dprog': bench_dprog,
+    'optim': bench_optim,
+    'parse_dump': bench_parse_dump,
+    'plot': bench_plot,
+    'flask': bench_flask,
+}
+
+def run_benchmarks(names):
+    """Run the named benchmarks, returns a dict of metrics"""
+    from trans import load_tables
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='dragster-bench-') as tmp:
+        workdir = Path(tmp)
+        load_tables(workdir / 'data')  # build transition tables (not measured)
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for name in names:
+                print(f"Running benchmark '{name}' ...", file=sys.stderr)
+                results.update(BENCHMARKS[name](workdir))
+        finally:
+            os.chdir(cwd)
+    return results
+
+def compare(results, baseline, tolerance):
+    """Relative changes w.r.t. the baseline, returns a list of (name, baseline, value, change, regression)"""
+    rows = []
+    for name, m in results.items():
+        b = baseline.get(name)
+        if b is None:
+            rows.append((name, None, m.value, None, False))
+            continue
+        change = (m.value - b['value'])/b['value'] if b['value'] else 0.0
+        worse = change if m.better == 'lower' else -change
+        rows.append((name, b['value'], m.value, change, worse > tolerance))
+    return rows
+
+
+if __name__ == "__main__":
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description="Run the Dragster benchmarks.")
+    parser.add_argument("names", nargs="*", default=list(BENCHMARKS), help=f"Benchmarks to run ({', '.join(BENCHMARKS)}).")
+    parser.add_argument("--output", metavar="FILE", help="Write the results to a JSON file.")
+    parser.add_argument("--compare", metavar="FILE", help="Compare the results with a baseline JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change flagged as regression.")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark '{name}'")
+
+    sys.path.insert(0, str(REPO))
+    results = run_benchmarks(args.names)
+
+    doc = dict(
+        date=datetime.now().isoformat(timespec='seconds'),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        machine=platform.machine(),
+        cpus=os.cpu_count(),
+        results={name: m._asdict() for name, m in results.items()},
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(doc, f, indent=2)
+        print(f"Wrote results to '{args.output}'.")
+
+    if args.compare is None:
+        print()
+        print(f"{'benchmark':26s}  {'value':>12s}  unit")
+        print("-"*48)
+        for name, m in results.items():
+            print(f"{name:26s}  {m.value:12.4g}  {m.unit}")
+        sys.exit(0)
+
+    with open(args.compare) as f:
+        baseline = json.load(f)['results']
+    rows = compare(results, baseline, args.tolerance)
+    print()
+    print(f"{'benchmark':26s}  {'baseline':>12s}  {'value':>12s}  {'change':>8s}  result")
+    print("-"*74)
+    for name, b, value, change, regression in rows:
+        print(f"{name:26s}  {'-' if b is None else f'{b:.4g}':>12s}  {value:12.4g}  "
+              f"{'-' if change is None else f'{100*change:+.1f}%':>8s}  {'REGRESSION' if regression else 'ok'}")
+    nreg = sum(1 for row in rows if row[4])
+    print()
+    print(f"{nreg} regressions (tolerance {100*args.tolerance:.0f}%).")
+    sys.exit(1 if nreg > 0 else 0)
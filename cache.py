@@ -0,0 +1,100 @@
+"""
+Bounded in-memory caches.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LRUCache:
+    """Thread-safe key/value cache with a memory cap (LRU eviction) and optional time-to-live.
+
+    The size of a value is estimated with `sizeof(value)` (in bytes). Entries
+    that have not been accessed for `ttl` seconds expire.
+    """
+
+    def __init__(self, maxsize, ttl=None, sizeof=lambda value: 1):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._items = OrderedDict()  # key -> (value, size, last access time)
+        self._lock = Lock()
+
+    def _remove(self, key):
+        value, size, _ = self._items.pop(key)
+        self.size -= size
+
+    def _expire(self, now):
+        if self.ttl is None:
+            return
+        while self._items:
+            key, (_, _, t) = next(iter(self._items.items()))
+            if now - t < self.ttl:
+                break
+            self._remove(key)
+            self.expirations += 1
+
+    def get(self, key, default=None):
+        """Value for key (or default), marking the entry as recently used."""
+        with self._lock:
+            now = monotonic()
+            self._expire(now)
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._items[key] = (item[0], item[1], now)
+            self._items.move_to_end(key)
+            return item[0]
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            now = monotonic()
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (value, size, now)
+            self.size += size
+            self._expire(now)
+            # evict least recently used entries (but keep the new one)
+            while self.size > self.maxsize and len(self._items) > 1:
+                self._remove(next(iter(self._items)))
+                self.evictions += 1
+
+    def __delitem__(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._expire(monotonic())
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """Cache statistics."""
+        with self._lock:
+            return dict(
+                entries=len(self._items),
+                size=self.size,
+                maxsize=self.maxsize,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                expirations=self.expirations,
+            )
@@ -1,10 +1,19 @@
 
 import argparse
+import multiprocessing as mp
 from datetime import datetime
-from itertools import product
+from itertools import islice, product
+from multiprocessing import shared_memory
 from pathlib import Path
-from sim import write_script
+from sim import sim, write_script
+from threading import BrokenBarrierError
 from time import perf_counter
+from trans import m, inputs, idx, frm, stp, phase, nxt, states, load_tables, VERSION
+
+import numpy as np
+import policy
+import store
+import telemetry
 
 
 # parse arguments
@@ -12,66 +21,39 @@ parser = argparse.ArgumentParser(description="Compute optimal Dragster inputs.")
 # parser.add_argument("--romname", default="Dragster (1980) (Activision)", help="The name of the ROM file.")
 parser.add_argument("--offset", type=int, default=0, help="Global frame counter offset for starting game.")
 parser.add_argument("--nsteps", type=int, default=168, help="Number of time steps to optimize.")
+parser.add_argument("--offsets", help="Solve several offsets (e.g. '0-7' or '0,3') in a single backward sweep (--nsteps for the last offset).")
 parser.add_argument("--save", action="store_true", help="Save best solution to Stella script file.")
+parser.add_argument("--policy", metavar="FILE", help="Memory-map the (bit-packed) policy to a .npy file.")
+parser.add_argument("--engine", choices=["numpy", "python"], default="numpy", help="Solver engine ('python' is the slow reference implementation).")
+parser.add_argument("--workers", type=int, default=1, help="Number of worker processes (numpy engine).")
+parser.add_argument("--prune", action="store_true", help="Only evaluate states reachable from the start states (numpy engine).")
+parser.add_argument("--checkpoint", metavar="FILE", help="Periodically save the Q layer and the computed policy rows to a .npz file.")
+parser.add_argument("--checkpoint-interval", type=float, default=300, help="Seconds between checkpoints.")
+parser.add_argument("--resume", action="store_true", help="Resume from the checkpoint file.")
+store.add_arguments(parser)
+telemetry.add_arguments(parser)
 args = parser.parse_args()
+if args.prune and args.engine == "python":
+    parser.error("--prune is not supported by the python engine")
+if args.resume and args.checkpoint is None:
+    parser.error("--resume requires --checkpoint")
+
+# start offsets (the transitions only depend on the frame number modulo 16, so the time steps of
+# all offsets are time steps of the first offset, and a single sweep ending nsteps after the last
+# offset solves all of them)
+offsets = [args.offset]
+if args.offsets:
+    offsets = []
+    for part in args.offsets.split(","):
+        lo, _, hi = part.partition("-")
+        offsets.extend(range(int(lo), int(hi or lo)+1))
+    offsets = sorted(set(offsets))
 
 # global parameters
-ofs = args.offset  # offset (in time steps) of game start relative to global frame counter [0-7]
-m = 2*5*32*254+1  # size of state space
-n = args.nsteps  # number of time steps (default 168 corresponds to a 5.57 finish time)
-
-#
-# dragster state x
-#   x[0]: clutch (c = 0..1)
-#   x[1]: gear (y = 0..4)
-#   x[2]: motor speed (r = 0..31)
-#   x[3]: dragster speed (v = 0..253)
-#
-# user inputs u
-#   u[0]: throttle
-#   u[1]: clutch
-#
-
-def idx(x):
-    """Computes linearized index for system state x"""
-    return (((x[0]*5 + x[1])*32 + x[2])*254 + x[3]) if x else m-1
-
-def frm(j, ofs):
-    """Compute frame number from time step"""
-    return 159 + 2*(j+ofs)
-
-def stp(frame, ofs):
-    """Compute time step from frame number"""
-    return (frame-159)//2 - ofs
-
-def nxt(j, ofs, u, x):
-    """Computes x[j+1] = f(u[j],x[j])"""
-    # unpack variables
-    c, y, r, v = x
-    th, cl = u
-    # motor speed (r)
-    mask = (0x00, 0x00, 0x02, 0x06, 0x0E)
-    rd = (3, 1, 1, 1, 1)
-    k = (1-c)*y
-    if frm(j, ofs) & mask[k] == 0:
-        r = max(r + (2*th-1)*rd[k], 0)
-    if r > 31:
-        return None
-    # dragster speed (v)
-    if y > 0 and c == 0:
-        vref = ((1 << y) >> 1)*r + ((1 << y) >> 2)*(r >= 20)
-        if vref < v:
-            v -= 1
-        elif vref > v:
-            if vref >= v + 16:
-                r -= 1
-            v += 2
-    # gear (y)
-    if cl == 0 and c == 1:
-        y = min(y+1, 4)
-    # clutch (c)
-    c = cl
-    return c, y, r, v
+ofs = offsets[0]  # offset (in time steps) of game start relative to global frame counter [0-7]
+n = args.nsteps + offsets[-1] - ofs  # number of time steps (default 168 corresponds to a 5.57 finish time)
+nkeep = offsets[-1] - ofs + 1  # number of Q layers kept (start time steps of all offsets)
+tel = telemetry.from_args(args, solver="dprog", offset=ofs, nsteps=n, offsets=offsets, engine=args.engine, workers=args.workers, prune=args.prune)
 
 def fmtspan(d, prec=3):
     """Format a time span (in fractional seconds) into hrs/min/sec components"""
@@ -94,53 +76,295 @@ def fmtspan(d, prec=3):
         return "{}.{:0{}}s".format(s, d, prec)
 
 
-# solve dynamic programming problem
-u = [[None]*m for j in range(n-1)]
-Q = [[0 if i<m-1 else -1 for i in range(m)] for j in range(n)]
-tbeg = perf_counter()
-for j in range(n-2, -1, -1):
-    print(f"Frame {j} (eta: {fmtspan((perf_counter()-tbeg)/(n-2-j)*(j+1), prec=1) if j < n-2 else 'n/a'})")
-    for xj in product(range(2), range(5), range(32), range(254)):
-        i = idx(xj)
-        umax = max(product(range(2),range(2)), key=lambda u: Q[j+1][idx(nxt(j+1, ofs, u, xj))])
-        u[j][i] = umax
-        Qmax = Q[j+1][idx(nxt(j+1, ofs, umax, xj))]
-        Q[j][i] = xj[3] + Qmax
-print(f"Solver finished: {datetime.now().strftime('%Y-%m-%d %H:%M')} ({fmtspan(perf_counter()-tbeg)})")
-
-# read out solution
-print()
-print("c  r     Q")
-print("------------")
-for c, r in product(range(2), range(0,32,3)):
-    print(f"{c} {r:2d}   {Q[0][idx((c, 0, r, 0))]:5d}")
-
-# find best starting condition
-x0 = max(product(range(2), range(0,32,3)), key=lambda x: Q[0][idx((x[0], 0, x[1], 0))])
-x0 = (x0[0], 0, x0[1], 0)
-
-print()
-print("j    frame  th  cl  c   y   r    v     Q")
-print("------------------------------------------")
-print(f"{j:<3d}  {frm(j, ofs):<5d}  -    -  {x0[0]:<2d}  {x0[1]:<2d}  {x0[2]:2d}  {x0[3]:3d}  {Q[0][idx(x0)]:5d}")
-xj = x0
-for j in range(1, n):
-    uj = u[j-1][idx(xj)]
-    xj = nxt(j, ofs, uj, xj)
-    Qj = Q[j][idx(xj)]
-    print(f"{j:<3d}  "
-          f"{frm(j, ofs):<5d}  "
-          f"{uj[0]:<2d}  "
-          f"{uj[1]:<2d}  "
-          f"{xj[0]:<2d}  "
-          f"{xj[1]:<2d}  "
-          f"{xj[2]:2d}  "
-          f"{xj[3]:3d}  "
-          f"{Qj:5d}  ")
+def save_checkpoint(path, j, Qj, P):
+    """Save the Q layer and the policy rows of time steps j, ..., n-2 (atomically)"""
+    tmp = path.with_suffix('.tmp.npz')
+    np.savez(tmp, Q=Qj, P=P[j:], j=j, offset=ofs, nsteps=n, offsets=offsets, nkeep=nkeep, version=VERSION, prune=args.prune)
+    tmp.replace(path)
+
+def load_checkpoint(path):
+    """Load the time step j, the Q layer and the policy rows j, ..., n-2 of a checkpoint"""
+    with np.load(path) as c:
+        for key, val in dict(offset=ofs, nsteps=n, offsets=offsets, nkeep=nkeep, version=VERSION, prune=args.prune).items():
+            if key not in c.files or not np.array_equal(c[key], val):
+                raise ValueError(f"Checkpoint '{path}' does not match: {key} = {c[key] if key in c.files else 'n/a'} (expected {val}).")
+        # the Q layers of the start time steps are not saved
+        if c['j'] < nkeep:
+            raise ValueError(f"Checkpoint '{path}' is at time step {c['j']} (below the start time steps).")
+        return int(c['j']), c['Q'], c['P']
+
+last_checkpoint = perf_counter()
+def checkpoint(j, Qj, P):
+    """Save a checkpoint after time step j (if due, and not within the kept Q layers)"""
+    global last_checkpoint
+    if args.checkpoint is None or j < nkeep or perf_counter()-last_checkpoint < args.checkpoint_interval:
+        return
+    save_checkpoint(Path(args.checkpoint), j, np.asarray(Qj, dtype=np.int32), P)
+    last_checkpoint = perf_counter()
+    tel.record('checkpoint', j=j)
+
+def solve_python(n, ofs, P, start=None, keep=1):
+    """Solve the dynamic programming problem (pure Python reference implementation)
+
+    Returns the Q layers of time steps 0, ..., keep-1.
+    """
+    Qn = [0 if i<m-1 else -1 for i in range(m)] if start is None else start[1].tolist()
+    jfirst = n-2 if start is None else start[0]-1
+    Qk = np.zeros((keep, m), dtype=np.int32)
+    tbeg = perf_counter()
+    tel.reset_step()
+    for j in range(jfirst, -1, -1):
+        print(f"Frame {j} (eta: {fmtspan((perf_counter()-tbeg)/(jfirst-j)*(j+1), prec=1) if j < jfirst else 'n/a'})")
+        Q = [0]*(m-1) + [-1]
+        u = [0]*m
+        for xj in product(range(2), range(5), range(32), range(254)):
+            i = idx(xj)
+            amax = max(range(len(inputs)), key=lambda a: Qn[idx(nxt(j+1, ofs, inputs[a], xj))])
+            u[i] = amax
+            Qmax = Qn[idx(nxt(j+1, ofs, inputs[amax], xj))]
+            Q[i] = xj[3] + Qmax
+        policy.pack(u, out=P[j])
+        Qn = Q
+        if j < keep:
+            Qk[j] = Qn
+        tel.step(j, states=m-1, pruned=0, lookups=(len(inputs)+1)*(m-1))
+        checkpoint(j, Qn, P)
+    return Qk, tbeg
+
+def sweep(j, ofs, T, v, Qj, Qn, Pj, lo, hi, R=None):
+    """Computes Q[j] and the policy at time step j for states lo..hi-1 (lo, hi multiples of 4)
+    or, if given, for the (sorted) states R within that range"""
+    p = phase(frm(j+1, ofs))
+    if R is None:
+        # Q values of successor states for all inputs (state x input matrix)
+        Qu = Qn[T[p, :, lo:hi]]
+        amax = np.argmax(Qu, axis=0)  # first maximum (same tie breaking as max())
+        policy.pack(amax, out=Pj[lo//4:hi//4])
+        Qj[lo:hi] = v[lo:hi] + np.take_along_axis(Qu, amax[None, :], axis=0)[0]
+    else:
+        R = R[np.searchsorted(R, lo):np.searchsorted(R, hi)]
+        Qu = Qn[T[p][:, R]]
+        amax = np.argmax(Qu, axis=0)
+        np.bitwise_or.at(Pj, R >> 2, (amax << 2*(R & 0x03)).astype(np.uint8))
+        Qj[R] = v[R] + np.take_along_axis(Qu, amax[None, :], axis=0)[0]
+
+def reachable(n, ofs, T, jstarts=(0,)):
+    """Computes the (sorted) sets of states reachable at time steps 0..n-1 from the start states
+    at time steps jstarts (starting at time step 0)"""
+    S = np.array(sorted(idx((c, 0, r, 0)) for c, r in product(range(2), range(0,32,3))), dtype=np.int32)
+    R = [S]
+    for j in range(1, n):
+        Rj = np.unique(T[phase(frm(j, ofs))][:, R[-1]])
+        Rj = Rj[Rj < m-1]
+        R.append(np.union1d(Rj, S) if j in jstarts else Rj)
+    return R
+
+def step_telemetry(j, R=None):
+    """Record time step j of the vectorized solvers (all states or the reachable states R[j])"""
+    evaluated = len(R[j]) if R else m-1
+    tel.step(j, states=evaluated, pruned=m-1-evaluated, lookups=len(inputs)*evaluated)
+
+def solve_numpy(n, ofs, P, R=None, start=None, keep=1):
+    """Solve the dynamic programming problem (vectorized implementation)
+
+    Returns the Q layers of time steps 0, ..., keep-1.
+    """
+    T = load_tables()
+    v = states()[3]
+    # rolling buffer of Q layers j and j+1
+    Q = np.zeros((2, m), dtype=np.int32)
+    Q[:, m-1] = -1
+    jfirst = n-2
+    if start is not None:
+        Q[start[0] & 1] = start[1]
+        jfirst = start[0]-1
+    Qk = np.zeros((keep, m), dtype=np.int32)
+    tbeg = perf_counter()
+    tel.reset_step()
+    for j in range(jfirst, -1, -1):
+        print(f"Frame {j} (eta: {fmtspan((perf_counter()-tbeg)/(jfirst-j)*(j+1), prec=1) if j < jfirst else 'n/a'})")
+        sweep(j, ofs, T, v, Q[j & 1], Q[(j+1) & 1], P[j], 0, m-1, R[j] if R else None)
+        if j < keep:
+            Qk[j] = Q[j & 1]
+        step_telemetry(j, R)
+        checkpoint(j, Q[j & 1], P)
+    return Qk, tbeg
+
+def worker(n, ofs, lo, hi, qname, pname, barrier, R, jfirst):
+    """Worker process computing the states lo..hi-1 of every time step"""
+    shmQ = shared_memory.SharedMemory(name=qname)
+    shmP = shared_memory.SharedMemory(name=pname) if pname else None
+    try:
+        Q = np.ndarray((2, m), dtype=np.int32, buffer=shmQ.buf)
+        P = np.ndarray((n-1, policy.rowsize(m)), dtype=np.uint8, buffer=shmP.buf) if shmP else np.load(args.policy, mmap_mode='r+')
+        T = load_tables()
+        v = states()[3]
+        for j in range(jfirst, -1, -1):
+            sweep(j, ofs, T, v, Q[j & 1], Q[(j+1) & 1], P[j], lo, hi, R[j] if R else None)
+            barrier.wait()  # sync once per step
+        del Q, P
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        shmQ.close()
+        if shmP:
+            shmP.close()
+
+def solve_workers(n, ofs, P, nworkers, R=None, start=None, keep=1):
+    """Solve the dynamic programming problem (vectorized, state space sharded over worker processes)
+
+    Returns the Q layers of time steps 0, ..., keep-1.
+    """
+    load_tables()  # make sure tables exist before starting workers
+    ctx = mp.get_context('fork')  # workers are forked (this script is not import safe)
+    # Q layers j and j+1 in shared memory
+    shmQ = shared_memory.SharedMemory(create=True, size=2*m*np.dtype(np.int32).itemsize)
+    # policy in shared memory (unless memory-mapped to a file)
+    shmP = shared_memory.SharedMemory(create=True, size=P.nbytes) if not isinstance(P, np.memmap) else None
+    try:
+        Q = np.ndarray((2, m), dtype=np.int32, buffer=shmQ.buf)
+        Q[:] = 0
+        Q[:, m-1] = -1
+        Pw = np.ndarray(P.shape, dtype=np.uint8, buffer=shmP.buf) if shmP else P
+        jfirst = n-2
+        if start is not None:
+            Q[start[0] & 1] = start[1]
+            Pw[:] = P
+            jfirst = start[0]-1
+        # shard boundaries (aligned to policy bytes)
+        bounds = [4*((k*((m-1)//4))//nworkers) for k in range(nworkers)] + [m-1]
+        Qk = np.zeros((keep, m), dtype=np.int32)
+        barrier = ctx.Barrier(nworkers+1)
+        procs = [ctx.Process(target=worker, args=(n, ofs, lo, hi, shmQ.name, shmP.name if shmP else None, barrier, R, jfirst))
+                 for lo, hi in zip(bounds[:-1], bounds[1:])]
+        tbeg = perf_counter()
+        tel.reset_step()
+        for p in procs:
+            p.start()
+        try:
+            for j in range(jfirst, -1, -1):
+                print(f"Frame {j} (eta: {fmtspan((perf_counter()-tbeg)/(jfirst-j)*(j+1), prec=1) if j < jfirst else 'n/a'})")
+                barrier.wait()
+                if j < keep:
+                    Qk[j] = Q[j & 1]  # workers only read layer j in the next step
+                step_telemetry(j, R)
+                checkpoint(j, Q[j & 1], Pw)  # workers wait at the next barrier until done
+        except BrokenBarrierError:
+            raise RuntimeError("Worker process failed.") from None
+        finally:
+            for p in procs:
+                p.join()
+        if shmP:
+            P[:] = Pw
+        del Q, Pw
+    finally:
+        shmQ.close()
+        shmQ.unlink()
+        if shmP:
+            shmP.close()
+            shmP.unlink()
+    return Qk, tbeg
+
+
+def readout(Qj, P, jo):
+    """Start state Q values and optimal trajectory of the offset starting at time step jo (from its Q layer)"""
+    o = ofs + jo
+    Qstart = [int(Qj[idx((c, 0, r, 0))]) for c, r in product(range(2), range(0,32,3))]
+    # find best starting condition
+    x0 = max(product(range(2), range(0,32,3)), key=lambda x: Qj[idx((x[0], 0, x[1], 0))])
+    xj = (x0[0], 0, x0[1], 0)
+    Qx = int(Qj[idx(xj)])
+    u, xs, Qs = [], [xj], [Qx]
+    for j in range(1, n-jo):
+        a = policy.get(P, jo+j-1, idx(xj))
+        Qx -= xj[3]  # Q[j][x[j]] = Q[j-1][x[j-1]] - v[j-1]
+        xj = nxt(j, o, inputs[a], xj)
+        u.append(a)
+        xs.append(xj)
+        Qs.append(Qx)
+    c, y, r, v = np.array(xs).T
+    return store.Result(np.array(u), Qs[0], dict(c=c, y=y, r=r, v=v, Q=np.array(Qs)), dict(start=Qstart))
+
+
+# look up stored results (the policy file needs a full solve)
+rs = store.from_args(args)
+keys = {o: rs.key("dprog", dict(offset=o, nsteps=n-(o-ofs))) for o in offsets}
+results = {o: rs.get(key) for o, key in keys.items()} if args.policy is None else {}
+tel.record('store', keys=list(keys.values()), hits=sum(res is not None for res in results.values()))
+if len(results) == len(offsets) and all(res is not None for res in results.values()):
+    for o, key in keys.items():
+        print(f"Loaded stored result {key[:12]} ({results[o].meta['created']}).")
+else:
+    # forward reachability analysis
+    R = None
+    if args.prune:
+        with tel.phase("reachable"):
+            R = reachable(n, ofs, load_tables(), [o-ofs for o in offsets])
+        print("j    reachable")
+        print("-----------------------")
+        for j, Rj in enumerate(R):
+            print(f"{j:<3d}  {len(Rj):5d}  ({100*len(Rj)/(m-1):5.1f}%)")
+        print(f"evaluated states: {sum(len(Rj) for Rj in R[:-1])} of {(n-1)*(m-1)} ({100*sum(len(Rj) for Rj in R[:-1])/((n-1)*(m-1)):.1f}%)")
+        print()
+
+    # resume from checkpoint
+    start = None
+    if args.resume:
+        try:
+            jstart, Qstart, Pstart = load_checkpoint(args.checkpoint)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+        start = (jstart, Qstart)
+        print(f"Resuming at frame {jstart-1} from checkpoint '{args.checkpoint}'.")
+
+    # solve dynamic programming problem
+    P = policy.alloc(n-1, m, args.policy)
+    if start is not None:
+        P[start[0]:] = Pstart
+    with tel.phase("solve"), tel.hot():
+        if args.engine == "python":
+            Qk, tbeg = solve_python(n, ofs, P, start, nkeep)
+        elif args.workers > 1:
+            Qk, tbeg = solve_workers(n, ofs, P, args.workers, R, start, nkeep)
+        else:
+            Qk, tbeg = solve_numpy(n, ofs, P, R, start, nkeep)
+    print(f"Solver finished: {datetime.now().strftime('%Y-%m-%d %H:%M')} ({fmtspan(perf_counter()-tbeg)})")
+
+    # read out (and store) the solutions of all offsets
+    for o in offsets:
+        res = readout(Qk[o-ofs], P, o-ofs)
+        rs.put(keys[o], res.u, res.objective, res.states, solver="dprog", params=dict(offset=o, nsteps=n-(o-ofs)), start=res.meta['start'])
+        results[o] = res
+
+if args.offsets is None:
+    res = results[ofs]
+    print()
+    print("c  r     Q")
+    print("------------")
+    for (c, r), Q in zip(product(range(2), range(0,32,3)), res.meta['start']):
+        print(f"{c} {r:2d}   {Q:5d}")
+
+    print()
+    print("j    frame  th  cl  c   y   r    v     Q")
+    print("------------------------------------------")
+    x0 = tuple(res.states[s][0] for s in "cyrv")
+    print(f"{0:<3d}  {frm(0, ofs):<5d}  -    -  {x0[0]:<2d}  {x0[1]:<2d}  {x0[2]:2d}  {x0[3]:3d}  {res.states['Q'][0]:5d}")
+    for j in range(1, n):
+        th, cl = inputs[res.u[j-1]]
+        print(f"{j:<3d}  "
+              f"{frm(j, ofs):<5d}  "
+              f"{th:<2d}  "
+              f"{cl:<2d}  "
+              f"{res.states['c'][j]:<2d}  "
+              f"{res.states['y'][j]:<2d}  "
+              f"{res.states['r'][j]:2d}  "
+              f"{res.states['v'][j]:3d}  "
+              f"{res.states['Q'][j]:5d}  ")
 
 
 # input generator from optimal solution
-def dproggen(ofs, x0):
+def dproggen(ofs, x0, u):
     t = 1  # inputs start at frame 1
     while stp(t, ofs) <= -x0[2]//3:
         yield 0, 0
@@ -148,26 +372,37 @@ def dproggen(ofs, x0):
     while stp(t, ofs) < 0:
         yield 1, 0
         t += 1
-    j = 0
     yield 1, x0[0]
-    t += 1
     yield 1, x0[0]
-    t += 1
-    j += 1
-    xj = x0
-    while j < n:
-        uj = u[j-1][idx(xj)]
-        xj = nxt(j, ofs, uj, xj)
-        yield uj[0], uj[1]
-        t += 1
-        yield uj[0], uj[1]
-        t += 1
-        j += 1
+    for a in u:
+        yield inputs[a]
+        yield inputs[a]
+
 
+if args.offsets is not None:
+    # compare offsets (finish time from the simulator)
+    print()
+    print("ofs  steps  c  r      Q  finish  frame  time")
+    print("----------------------------------------------")
+    for o, res in results.items():
+        x0 = tuple(int(res.states[s][0]) for s in "cyrv")
+        # frames 0, ..., frm(N, o)-1 (the inputs end there, race not finished)
+        for s in islice(sim(dproggen(o, x0, res.u), 2*o), frm(len(res.u)+1, o)):
+            if s.status == 0x0100 and s.frame > frm(0, o) or s.status == 0x0001:
+                break
+        if s.status == 0x0100:
+            print(f"{o:<3d}  {len(res.u)+1:<5d}  {x0[0]}  {x0[2]:2d}  {res.objective:5d}  {stp(s.frame, o):<6d}  {s.frame:<5d}  {s.time//100/100:4.2f}")
+        else:
+            print(f"{o:<3d}  {len(res.u)+1:<5d}  {x0[0]}  {x0[2]:2d}  {res.objective:5d}  -")
 
 if args.save:
-    # write Stella debug script
-    print(f"Writing script file 'dprog{n:03d}_ofs{2*ofs:X}'.")
+    # write Stella debug scripts
     Path('scripts').mkdir(parents=True, exist_ok=True)  # create 'scripts' directory
-    with open(f"scripts/dprog{n:03d}_ofs{2*ofs:X}.script", "w") as script:
-        write_script(script, dproggen(ofs, x0), 2*ofs, frm(n, ofs)-1)
+    for o, res in results.items():
+        N = len(res.u)+1
+        x0 = tuple(int(res.states[s][0]) for s in "cyrv")
+        print(f"Writing script file 'dprog{N:03d}_ofs{2*o:X}'.")
+        with open(f"scripts/dprog{N:03d}_ofs{2*o:X}.script", "w") as script:
+            write_script(script, dproggen(o, x0, res.u), 2*o, frm(N, o)-1)
+
+tel.close(objectives={o: int(res.objective) for o, res in results.items()})
@@ -1,12 +1,25 @@
 
+import hashlib
+import multiprocessing as mp
+import os
+import sys
+
 from base64 import b64encode
 from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
 from flask import Flask, session, render_template, jsonify, redirect, url_for, escape, request
 from http import HTTPStatus
 from itertools import islice
 from os import urandom
+from threading import Lock
+from weakref import WeakValueDictionary
+
+import advisor
+from cache import LRUCache
+from sim import sim, Trace
+from trans import frm, stp
 
-from sim import sim
+import numpy as np
 
 # FrameState record
 #   offset:     offset w.r.t global frame counter
@@ -14,68 +27,259 @@ from sim import sim
 #   nskip:      number of frames to skip at beginning (for drawing only)
 #   uth:        throttle user inputs
 #   ucl:        clutch user inputs
-#   states:     simulated frame states
-Model = namedtuple('Model', ['offset', 'maxframes', 'nskip', 'uth', 'ucl', 'states'])
+#   states:     simulated frame states (Trace)
+#   checkpoints: simulator states (every CHECKPOINT_INTERVAL frames)
+Model = namedtuple('Model', ['offset', 'maxframes', 'nskip', 'uth', 'ucl', 'states', 'checkpoints'])
+
+# number of frames between simulator checkpoints
+CHECKPOINT_INTERVAL = 32
+
+# session store and simulation result cache limits
+SESSION_STORE_SIZE = 256 << 20  # bytes
+SESSION_TTL = 3600  # seconds
+RESULT_CACHE_SIZE = 64 << 20  # bytes
+
+# number of simulation worker processes (no pool on a single CPU, where it cannot run simulations in parallel)
+SIM_WORKERS = os.cpu_count() or 1
+# re-simulations of fewer frames run inline (a simulation costs about 8 us per frame and a worker
+# round trip 0.3-0.7 ms, which would take up a third or more of a shorter re-simulation)
+POOL_MIN_FRAMES = 128
 
 # input generator from lists
-def listgen(uth, ucl):
-    t = 1  # inputs start at frame 1
+def listgen(uth, ucl, t=1):
+    # inputs start at frame 1
     while t < len(uth) and t < len(ucl):
         yield uth[t], ucl[t]
         t += 1
 
+# simulator snapshot callback saving periodic checkpoints
+def checkpointer(checkpoints):
+    def snapshot(s):
+        if s.t % CHECKPOINT_INTERVAL == 0 and (len(checkpoints) == 0 or checkpoints[-1].t < s.t):
+            checkpoints.append(s)
+    return snapshot
+
+def result_key(offset, nskip, uth, ucl):
+    """Key of the simulation result for the given inputs"""
+    return hashlib.sha1(f"{offset},{nskip},{len(uth)},{len(ucl)}:".encode() + bytes(uth) + bytes(ucl)).digest()
+
+def result_size(r):
+    """Estimated memory footprint of a simulation result (states, checkpoints) in bytes"""
+    states, checkpoints = r
+    return states.data.nbytes + sum(sys.getsizeof(cp) for cp in checkpoints)
+
+def model_size(m):
+    """Estimated memory footprint of a model in bytes"""
+    return result_size((m.states, m.checkpoints)) + sys.getsizeof(m.uth) + sys.getsizeof(m.ucl)
+
+def resimulate(offset, nskip, uth, ucl, cp=None):
+    """Simulate the inputs (resuming at checkpoint cp if given), returns the states and the new checkpoints"""
+    checkpoints = []
+    nframes = min(len(uth), len(ucl))  # stop when the inputs are exhausted (race not finished)
+    if cp is None:
+        states = sim(listgen(uth, ucl), offset, snapshot=checkpointer(checkpoints))
+    else:
+        states = sim(listgen(uth, ucl, cp.t+1), offset, resume=cp, snapshot=checkpointer(checkpoints))
+        nskip = max(nskip-cp.t, 0)
+        nframes -= cp.t
+    return Trace.from_states(islice(states, nskip, nframes)), checkpoints
+
+def simulate(offset, nskip, uth, ucl, cp=None):
+    """Run resimulate() inline or, for long re-simulations, in the simulation worker pool"""
+    nframes = min(len(uth), len(ucl)) - (cp.t if cp is not None else 0)
+    if pool is None or nframes < POOL_MIN_FRAMES:
+        return resimulate(offset, nskip, uth, ucl, cp)
+    return pool.submit(resimulate, offset, nskip, uth, ucl, cp).result()
+
 def compute_model(offset, maxframes, nskip, uth, ucl):
+    key = result_key(offset, nskip, uth, ucl)
+    r = results.get(key)
+    if r is None:
+        states, checkpoints = simulate(offset, nskip, uth, ucl)
+        r = results[key] = (states, tuple(checkpoints))
     return Model(
         offset=offset,
         maxframes=maxframes,
         nskip=nskip,
         uth=uth,
         ucl=ucl,
-        states=list(islice(sim(listgen(uth, ucl), offset), nskip, None))
+        states=r[0],
+        checkpoints=r[1]
     )
 
-# global model dict (holding session data)
-model = {}
+def update_model(m, frame):
+    """Re-simulate model m after an input change in the given frame (starting at the last checkpoint before that frame)."""
+    key = result_key(m.offset, m.nskip, m.uth, m.ucl)
+    r = results.get(key)
+    if r is not None:
+        return m._replace(states=r[0], checkpoints=r[1])
+    checkpoints = [cp for cp in m.checkpoints if cp.t < frame]
+    if len(checkpoints) == 0:
+        return compute_model(m.offset, m.maxframes, m.nskip, m.uth, m.ucl)
+    cp = checkpoints[-1]
+    states, newcheckpoints = simulate(m.offset, m.nskip, m.uth, m.ucl, cp)
+    states = m.states[:max(cp.t-m.nskip, 0)].concat(states)
+    r = results[key] = (states, tuple(checkpoints + [c for c in newcheckpoints if c.t > cp.t]))
+    return m._replace(states=r[0], checkpoints=r[1])
+
+class EditQueue:
+    """Pending input toggles of a session, applied in batches (one re-simulation per batch)"""
+
+    def __init__(self):
+        self.lock = Lock()     # guards pending and batch
+        self.running = Lock()  # serializes the batches of the session
+        self.pending = []
+        self.batch = None      # result of the next batch (None if no batch is waiting)
+
+    def submit(self, toggles, apply):
+        """Queue toggles, returns the result of apply(batch) for the batch containing them"""
+        with self.lock:
+            self.pending.extend(toggles)
+            batch, leader = self.batch, self.batch is None
+            if leader:
+                batch = self.batch = Future()
+        if leader:
+            # the first request of a batch applies all toggles queued until the previous batch is done
+            with self.running:
+                with self.lock:
+                    toggles, self.pending, self.batch = self.pending, [], None
+                try:
+                    batch.set_result(apply(toggles))
+                except Exception as e:
+                    batch.set_exception(e)
+        return batch.result()
+
+# global session store (holding session data)
+model = LRUCache(SESSION_STORE_SIZE, SESSION_TTL, model_size)
+# global cache of simulation results (shared across sessions)
+results = LRUCache(RESULT_CACHE_SIZE, sizeof=result_size)
+# edit queues of sessions with pending toggles
+queues = WeakValueDictionary()
+queues_lock = Lock()
+# simulation worker pool, created before serving (the workers are started by a fork server, so they
+# do not inherit locks held by request threads), not in the worker processes themselves
+pool = ProcessPoolExecutor(SIM_WORKERS, mp_context=mp.get_context('forkserver')) \
+    if SIM_WORKERS > 1 and mp.parent_process() is None else None
+# optimal input advice tables (memory-mapped once, shared by all workers)
+advice = advisor.load_tables()
+if advice is None:
+    print("advice tables not found (run 'python3 advisor.py'), /advice is disabled")
 
 app = Flask(__name__)
 app.secret_key = urandom(16)
 
-@app.route('/')
-def index():
-    if 'key' not in session:
-        # create unique session key
-        key = urandom(16)
-        print(f"init session with key {b64encode(key).decode('utf-8')}")
-        session['key'] = key
+def statesjson(m, start=0):
+    """JSON representation of the model states (starting at state index start)"""
+    return jsonify(
+        nskip=m.nskip,
+        length=len(m.states),
+        start=start,
+        states={f: col[start:].tolist() for f, col in m.states.to_numpy().items()}
+    )
+
+def firstdiff(a, b):
+    """Index of the first differing state of two traces"""
+    n = min(len(a), len(b))
+    d = np.flatnonzero((a.data[:, :n] != b.data[:, :n]).any(axis=0))
+    return int(d[0]) if len(d) > 0 else n
+
+def session_model():
+    """Model of the current session (initializing session if necessary)"""
+    key = session.get('key')
+    m = model.get(key) if key is not None else None
+    if m is None:
+        if key is None:
+            # create unique session key
+            key = urandom(16)
+            print(f"init session with key {b64encode(key).decode('utf-8')}")
+            session['key'] = key
+        else:
+            print(f"re-init expired session with key {b64encode(key).decode('utf-8')}")
         offset = 0
         maxframes = 495
         nskip = 140
         uth = [0 if j-offset < 149 or j-offset in (173, 174, 195, 196, 197, 198, 229, 230, 449, 450, 465, 466, 481, 482) else 1 for j in range(maxframes)]
         ucl = [1 if j-offset in (159, 160, 193, 194, 227, 228, 267, 268, 311, 312, 333, 334, 359, 360, 377, 378, 395, 396, 447, 448, 449, 450, 463, 464, 465, 466, 479, 480, 481, 482) else 0 for j in range(maxframes)]
-        model[key] = compute_model(offset, maxframes, nskip, uth, ucl)
-    key = session['key']
-    # print(model[key])
-    return render_template('race.html.j2', nskip=model[key].nskip, states=model[key].states)
+        m = model[key] = compute_model(offset, maxframes, nskip, uth, ucl)
+    # print(m)
+    return m
+
+@app.route('/')
+def index():
+    session_model()
+    return render_template('race.html.j2')
+
+@app.route('/states')
+def states():
+    return statesjson(session_model())
+
+def parse_toggles(content, m):
+    """Valid (type, frame) toggles of a request (a single toggle, a list of toggles or {'toggles': [...]})"""
+    if isinstance(content, dict):
+        content = content.get('toggles', [content])
+    if not isinstance(content, list):
+        return []
+    toggles = []
+    for t in content:
+        if not isinstance(t, dict) or t.get('type', None) not in ('th', 'cl'):
+            continue
+        try:
+            i = int(t.get('frame', -1))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= i < len(m.uth if t['type'] == 'th' else m.ucl):
+            toggles.append((t['type'], i))
+    return toggles
+
+def apply_toggles(toggles):
+    """Apply a batch of toggles to the session model, returns the (old, new) models"""
+    m = session_model()
+    uth, ucl = list(m.uth), list(m.ucl)
+    for type, i in toggles:
+        u = uth if type == 'th' else ucl
+        u[i] = 1 - u[i]
+    mnew = model[session['key']] = update_model(m._replace(uth=uth, ucl=ucl), min(i for _, i in toggles))
+    print(f"toggled {' '.join(f'({type},{i})' for type, i in toggles)}")
+    return m, mnew
 
 @app.route('/u', methods=['POST'])
 def toggle():
-    r = 'none'
     if 'key' in session:
-        m = model[session['key']]
-        u = None
-        content = request.get_json(silent=True)
-        if content.get('type', None) == 'th':
-            u = m.uth
-        elif content.get('type', None) == 'cl':
-            u = m.ucl
-        try:
-            i = int(content.get('frame', -1))
-        except ValueError:
-            i = -1
-        if u is not None and 0 <= i < len(u):
-            u[i] = 1 - u[i]
-            model[session['key']] = compute_model(m.offset, m.maxframes, m.nskip, m.uth, m.ucl)
-            r = f"({content.get('type')},{content.get('frame')})"
-            print(f"toggled {r}")
+        toggles = parse_toggles(request.get_json(silent=True), session_model())
+        if toggles:
+            key = session['key']
+            with queues_lock:
+                q = queues.get(key)
+                if q is None:
+                    q = queues[key] = EditQueue()
+            m, mnew = q.submit(toggles, apply_toggles)
+            # return changed states only
+            return statesjson(mnew, firstdiff(m.states, mnew.states))
     return ('', HTTPStatus.NO_CONTENT)
-    # return render_template('race.html.j2', maxframes=m.maxframes, states=m.states)
+
+@app.route('/stats')
+def stats():
+    return jsonify(sessions=model.stats(), results=results.stats())
+
+@app.route('/advice')
+def advise():
+    """Optimal input of a frame and earliest finish from the race state of the session (table lookups only)"""
+    if advice is None:
+        return jsonify(error="advice tables not built"), HTTPStatus.SERVICE_UNAVAILABLE
+    m = session_model()
+    try:
+        frame = int(request.args.get('frame', ''))
+    except ValueError:
+        return jsonify(error="invalid frame"), HTTPStatus.BAD_REQUEST
+    # the input of time step j is applied in frame frm(j) to the state of time step j-1
+    ofs = m.offset // 2
+    j = stp(frame, ofs)
+    k = frm(j-1, ofs) - m.nskip
+    if j < 1 or not 0 <= k < len(m.states) or m.states[k].status != 0:
+        return jsonify(error=f"no race state before frame {frame}"), HTTPStatus.BAD_REQUEST
+    s = m.states[k]
+    a = advisor.advise(advice, ofs, j-1, s.x, (s.cl, s.y, s.r, s.v))
+    finish = None
+    if a.finish is not None:
+        finish = dict(step=a.finish, frame=frm(a.finish, ofs), time=a.finish*334//100/100)
+    return jsonify(frame=frm(j, ofs), th=a.th, cl=a.cl, finish=finish)
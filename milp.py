@@ -0,0 +1,462 @@
+"""
+Backend-neutral mixed-integer linear programs.
+
+Models are formulated with arrays of variables and linear expressions (`Expr`)
+and stored in matrix form (sparse constraint matrix, bounds, objective). They
+can be written to LP/MPS files or solved with HiGHS (`highspy`), CBC (command
+line) or Gurobi (`gurobipy`). The solver packages are only imported when used.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from collections import namedtuple
+from math import prod
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+
+# objective sense
+MINIMIZE = 1
+MAXIMIZE = -1
+
+# variable types
+CONTINUOUS = 'C'
+INTEGER = 'I'
+BINARY = 'B'
+
+# solution status
+OPTIMAL = 'optimal'
+FEASIBLE = 'feasible'  # solution found, but not proven optimal (e.g. time limit)
+INFEASIBLE = 'infeasible'
+UNBOUNDED = 'unbounded'
+UNKNOWN = 'unknown'
+
+SOLVERS = ('highs', 'cbc', 'gurobi')
+
+
+class Expr:
+    """Array of linear expressions sum(coef[k]*x[var[k]], k) + const."""
+
+    __array_ufunc__ = None  # numpy operands defer to the Expr operators
+    __hash__ = None
+
+    def __init__(self, terms, const=0.0):
+        self.shape = np.broadcast_shapes(np.shape(const), *(np.shape(a) for term in terms for a in term))
+        self.terms = [(np.broadcast_to(np.asarray(c, dtype=np.float64), self.shape), np.broadcast_to(v, self.shape)) for c, v in terms]
+        self.const = np.broadcast_to(np.asarray(const, dtype=np.float64), self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return Expr([(c[key], v[key]) for c, v in self.terms], self.const[key])
+
+    def __add__(self, other):
+        if isinstance(other, Expr):
+            return Expr(self.terms + other.terms, self.const + other.const)
+        return Expr(self.terms, self.const + other)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return Expr([(-c, v) for c, v in self.terms], -self.const)
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __rsub__(self, other):
+        return (-self) + other
+
+    def __mul__(self, other):
+        if isinstance(other, Expr):
+            raise TypeError("Products of expressions are not linear.")
+        return Expr([(c*other, v) for c, v in self.terms], self.const*other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        return self * (1.0/np.asarray(other, dtype=np.float64))
+
+    def __le__(self, other):
+        return Constr(self - other, '<')
+
+    def __ge__(self, other):
+        return Constr(self - other, '>')
+
+    def __eq__(self, other):
+        return Constr(self - other, '=')
+
+    def sum(self, axis=0):
+        """Sum of expressions along an axis"""
+        index = (slice(None),)*axis
+        return sum((self[index + (k,)] for k in range(1, self.shape[axis])), self[index + (0,)])
+
+    def value(self, x):
+        """Values of the expressions for variable values x"""
+        return self.const + sum((c*x[v] for c, v in self.terms), np.zeros(self.shape))
+
+
+# Constr record (constraints expr <sense> 0)
+#   expr:      linear expressions (Expr)
+#   sense:     '<', '>' or '='
+Constr = namedtuple('Constr', ['expr', 'sense'])
+
+# Solution record
+#   status:    solution status (OPTIMAL, FEASIBLE, INFEASIBLE, UNBOUNDED, UNKNOWN)
+#   objective: objective value (or None)
+#   x:         variable values (or None)
+#   load:      model load time (in seconds)
+#   solve:     solve time (in seconds)
+Solution = namedtuple('Solution', ['status', 'objective', 'x', 'load', 'solve'])
+
+
+class Model:
+    """Mixed-integer linear program in matrix form."""
+
+    def __init__(self, name='model', sense=MINIMIZE):
+        self.name = name
+        self.sense = sense
+        self.nvars = 0
+        self.nconstrs = 0
+        self._vars = []     # variable blocks (name, shape, lb, ub, obj, integer)
+        self._constrs = []  # constraint blocks (name, shape, rows, cols, vals, rhs, sense)
+        self._start = {}    # start values (variable index -> value)
+
+    def add_vars(self, shape, vtype=CONTINUOUS, lb=0.0, ub=None, obj=0.0, name='x'):
+        """Add an array of variables (bounds and objective coefficients are broadcast to shape)"""
+        shape = tuple(shape) if np.iterable(shape) else (shape,)
+        if ub is None:
+            ub = 1.0 if vtype == BINARY else np.inf
+        size = prod(shape)
+        self._vars.append((
+            name, shape,
+            np.broadcast_to(np.asarray(lb, dtype=np.float64), shape).ravel(),
+            np.broadcast_to(np.asarray(ub, dtype=np.float64), shape).ravel(),
+            np.broadcast_to(np.asarray(obj, dtype=np.float64), shape).ravel(),
+            vtype != CONTINUOUS
+        ))
+        idx = np.arange(self.nvars, self.nvars + size).reshape(shape)
+        self.nvars += size
+        return Expr([(1.0, idx)])
+
+    def add_constrs(self, constr, name='c'):
+        """Add an array of constraints"""
+        expr, sense = constr
+        size = prod(expr.shape)
+        rows = self.nconstrs + np.arange(size)
+        cols = [v.ravel() for _, v in expr.terms]
+        vals = [c.ravel() for c, _ in expr.terms]
+        self._constrs.append((
+            name, expr.shape,
+            np.tile(rows, len(expr.terms)),
+            np.concatenate(cols) if cols else np.zeros(0, dtype=np.int64),
+            np.concatenate(vals) if vals else np.zeros(0),
+            0.0 - expr.const.ravel(),
+            sense
+        ))
+        self.nconstrs += size
+
+    def set_start(self, x, values):
+        """Set start values for an array of variables"""
+        for i, val in zip(x.terms[0][1].ravel(), np.broadcast_to(values, x.shape).ravel()):
+            self._start[int(i)] = float(val)
+
+    def columns(self):
+        """Variable data as arrays (lb, ub, obj, integer)"""
+        return tuple(np.concatenate([b[k] for b in self._vars]) if self._vars else np.zeros(0)
+                     for k in range(2, 5)) + \
+               (np.concatenate([np.full(len(b[2]), b[5]) for b in self._vars]) if self._vars else np.zeros(0, dtype=bool),)
+
+    def rows(self):
+        """Constraint data as arrays (rhs, sense)"""
+        rhs = np.concatenate([b[5] for b in self._constrs]) if self._constrs else np.zeros(0)
+        sense = np.concatenate([np.full(len(b[5]), b[6]) for b in self._constrs]) if self._constrs else np.zeros(0, dtype='U1')
+        return rhs, sense
+
+    def matrix(self, colwise=True):
+        """Constraint matrix in compressed column (or row) format (start, index, value)"""
+        rows = np.concatenate([b[2] for b in self._constrs]) if self._constrs else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate([b[3] for b in self._constrs]) if self._constrs else np.zeros(0, dtype=np.int64)
+        vals = np.concatenate([b[4] for b in self._constrs]) if self._constrs else np.zeros(0)
+        major, minor, nmajor, nminor = (cols, rows, self.nvars, self.nconstrs) if colwise else (rows, cols, self.nconstrs, self.nvars)
+        # sum duplicate entries, drop zeros
+        keys, inv = np.unique(major.astype(np.int64)*nminor + minor, return_inverse=True)
+        vals = np.bincount(inv.ravel(), weights=vals, minlength=len(keys))
+        nz = vals != 0
+        keys, vals = keys[nz], vals[nz]
+        start = np.searchsorted(keys // max(nminor, 1), np.arange(nmajor+1))
+        return start.astype(np.int32), (keys % max(nminor, 1)).astype(np.int32), vals
+
+    def varnames(self):
+        return [f"{name}({','.join(map(str, i))})" for name, shape, *_ in self._vars for i in np.ndindex(*shape)]
+
+    def constrnames(self):
+        return [f"{name}({','.join(map(str, i))})" for name, shape, *_ in self._constrs for i in np.ndindex(*shape)]
+
+    def start(self):
+        """Start values (NaN for variables without start value)"""
+        x = np.full(self.nvars, np.nan)
+        for i, val in self._start.items():
+            x[i] = val
+        return x
+
+    def violations(self, x, tol=1e-6):
+        """Number of bounds and constraints violated by variable values x"""
+        lb, ub, _, _ = self.columns()
+        rhs, sense = self.rows()
+        start, index, value = self.matrix(colwise=False)
+        ax = np.add.reduceat(np.append(value*x[index], 0.0), start[:-1]) * (start[:-1] < start[1:])
+        nbounds = int(np.count_nonzero((x < lb-tol) | (x > ub+tol)))
+        nconstrs = int(np.count_nonzero(np.where(sense == '<', ax > rhs+tol, np.where(sense == '>', ax < rhs-tol, np.abs(ax-rhs) > tol))))
+        return nbounds, nconstrs
+
+    def write(self, path):
+        """Write the model to an LP or MPS file (depending on the file suffix)"""
+        path = Path(path)
+        if path.suffix == '.lp':
+            write_lp(self, path)
+        elif path.suffix == '.mps':
+            write_mps(self, path)
+        else:
+            raise ValueError(f"Unsupported model file format: '{path}'.")
+
+
+def _bounds(lb, ub, integer):
+    # bound lines of all variables (kind, value) in MPS terms
+    for l, u, i in zip(lb, ub, integer):
+        if l == u:
+            yield (('FX', l),)
+        else:
+            b = ()
+            if l == -np.inf:
+                b += (('MI', None),)
+            elif l != 0:
+                b += (('LO', l),)
+            if u != np.inf:
+                b += (('UP', u),)
+            elif i:
+                b += (('PL', None),)
+            yield b
+
+
+def write_mps(model, path, objsense=True):
+    """Write a model to a free MPS file (minimizing -obj for maximization models if not objsense)"""
+    lb, ub, obj, integer = model.columns()
+    rhs, sense = model.rows()
+    start, index, value = model.matrix()
+    vnames = model.varnames()
+    cnames = model.constrnames()
+    if not objsense:
+        obj = obj * model.sense
+    with open(path, 'w') as f:
+        f.write(f"NAME {model.name}\n")
+        if objsense:
+            f.write(f"OBJSENSE\n    {'MAX' if model.sense == MAXIMIZE else 'MIN'}\n")
+        f.write("ROWS\n N obj\n")
+        f.writelines(f" {'L' if s == '<' else 'G' if s == '>' else 'E'} {name}\n" for s, name in zip(sense, cnames))
+        f.write("COLUMNS\n")
+        marker = False
+        for j, name in enumerate(vnames):
+            if integer[j] != marker:
+                marker = integer[j]
+                f.write(f"    MARKER 'MARKER' '{'INTORG' if marker else 'INTEND'}'\n")
+            if obj[j] != 0:
+                f.write(f"    {name} obj {obj[j]:.12g}\n")
+            f.writelines(f"    {name} {cnames[i]} {a:.12g}\n" for i, a in zip(index[start[j]:start[j+1]], value[start[j]:start[j+1]]))
+            if obj[j] == 0 and start[j] == start[j+1]:
+                f.write(f"    {name} obj 0\n")
+        if marker:
+            f.write("    MARKER 'MARKER' 'INTEND'\n")
+        f.write("RHS\n")
+        f.writelines(f"    rhs {name} {b:.12g}\n" for name, b in zip(cnames, rhs) if b != 0)
+        f.write("BOUNDS\n")
+        for name, bounds in zip(vnames, _bounds(lb, ub, integer)):
+            f.writelines(f" {kind} bnd {name}{'' if b is None else f' {b:.12g}'}\n" for kind, b in bounds)
+        f.write("ENDATA\n")
+
+
+def write_lp(model, path):
+    """Write a model to a CPLEX LP file"""
+    lb, ub, obj, integer = model.columns()
+    rhs, sense = model.rows()
+    start, index, value = model.matrix(colwise=False)
+    vnames = model.varnames()
+    cnames = model.constrnames()
+
+    def terms(coefs, names):
+        # linear expression (broken into lines of moderate length)
+        line, lines = [], []
+        for a, name in zip(coefs, names):
+            line.append(f"{'+' if a >= 0 else '-'} {abs(a):.12g} {name}")
+            if len(line) == 8:
+                lines.append(' '.join(line))
+                line = []
+        if line or not lines:
+            lines.append(' '.join(line) if line else '0 ' + vnames[0])
+        return '\n   '.join(lines)
+
+    with open(path, 'w') as f:
+        f.write(f"\\ {model.name}\n")
+        f.write("Maximize\n" if model.sense == MAXIMIZE else "Minimize\n")
+        nz = np.flatnonzero(obj)
+        f.write(f" obj: {terms(obj[nz], [vnames[j] for j in nz])}\n")
+        f.write("Subject To\n")
+        for i, name in enumerate(cnames):
+            s = slice(start[i], start[i+1])
+            f.write(f" {name}: {terms(value[s], [vnames[j] for j in index[s]])} {'<=' if sense[i] == '<' else '>=' if sense[i] == '>' else '='} {rhs[i]:.12g}\n")
+        f.write("Bounds\n")
+        for name, l, u in zip(vnames, lb, ub):
+            if l == u:
+                f.write(f" {name} = {l:.12g}\n")
+            else:
+                f.write(f" {'-inf' if l == -np.inf else f'{l:.12g}'} <= {name} <= {'+inf' if u == np.inf else f'{u:.12g}'}\n")
+        if integer.any():
+            f.write("Generals\n")
+            f.writelines(f" {vnames[j]}\n" for j in np.flatnonzero(integer))
+        f.write("End\n")
+
+
+def solve(model, solver='highs', time_limit=None, verbose=True):
+    """Solve a model with the given solver backend"""
+    if solver == 'highs':
+        return solve_highs(model, time_limit, verbose)
+    if solver == 'cbc':
+        return solve_cbc(model, time_limit, verbose)
+    if solver == 'gurobi':
+        return solve_gurobi(model, time_limit, verbose)
+    raise ValueError(f"Unknown solver '{solver}' (expected one of {', '.join(SOLVERS)}).")
+
+
+def solve_highs(model, time_limit=None, verbose=True):
+    """Solve a model with HiGHS (highspy)"""
+    import highspy
+
+    tbeg = perf_counter()
+    lb, ub, obj, integer = model.columns()
+    rhs, sense = model.rows()
+    start, index, value = model.matrix()
+    lp = highspy.HighsLp()
+    lp.num_col_ = model.nvars
+    lp.num_row_ = model.nconstrs
+    lp.sense_ = highspy.ObjSense.kMaximize if model.sense == MAXIMIZE else highspy.ObjSense.kMinimize
+    lp.col_cost_ = obj
+    lp.col_lower_ = lb
+    lp.col_upper_ = ub
+    lp.row_lower_ = np.where(sense == '<', -np.inf, rhs)
+    lp.row_upper_ = np.where(sense == '>', np.inf, rhs)
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    lp.a_matrix_.start_ = start
+    lp.a_matrix_.index_ = index
+    lp.a_matrix_.value_ = value
+    lp.integrality_ = [highspy.HighsVarType.kInteger if i else highspy.HighsVarType.kContinuous for i in integer]
+    h = highspy.Highs()
+    h.setOptionValue('output_flag', bool(verbose))
+    if time_limit is not None:
+        h.setOptionValue('time_limit', float(time_limit))
+    h.passModel(lp)
+    x0 = model.start()
+    known = np.flatnonzero(~np.isnan(x0))
+    if len(known) > 0:
+        h.setSolution(len(known), known.astype(np.int32), x0[known])
+    tload = perf_counter() - tbeg
+
+    tbeg = perf_counter()
+    h.run()
+    tsolve = perf_counter() - tbeg
+    ms = h.getModelStatus()
+    found = h.getInfo().primal_solution_status == 2  # feasible
+    status = OPTIMAL if ms == highspy.HighsModelStatus.kOptimal else \
+             INFEASIBLE if ms == highspy.HighsModelStatus.kInfeasible else \
+             UNBOUNDED if ms in (highspy.HighsModelStatus.kUnbounded, highspy.HighsModelStatus.kUnboundedOrInfeasible) else \
+             FEASIBLE if found else UNKNOWN
+    if status not in (OPTIMAL, FEASIBLE):
+        return Solution(status, None, None, tload, tsolve)
+    return Solution(status, h.getInfo().objective_function_value, np.array(h.getSolution().col_value), tload, tsolve)
+
+
+def solve_cbc(model, time_limit=None, verbose=True):
+    """Solve a model with the CBC command line solver (start values are not supported)"""
+    cbc = shutil.which('cbc')
+    if cbc is None:
+        raise RuntimeError("CBC solver executable 'cbc' not found.")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tbeg = perf_counter()
+        mps = os.path.join(tmp, 'model.mps')
+        sol = os.path.join(tmp, 'model.sol')
+        write_mps(model, mps, objsense=False)  # minimize model.sense*obj
+        tload = perf_counter() - tbeg
+
+        tbeg = perf_counter()
+        cmd = [cbc, mps] + (['sec', str(time_limit)] if time_limit is not None else []) + \
+              ['solve', 'printingOptions', 'normal', 'solution', sol]
+        subprocess.run(cmd, check=True, stdout=None if verbose else subprocess.DEVNULL)
+        tsolve = perf_counter() - tbeg
+        # solution lines (index, name, value, reduced cost) of the nonzero columns
+        columns = {name: j for j, name in enumerate(model.varnames())}
+        with open(sol) as f:
+            header = f.readline()
+            x = np.zeros(model.nvars)
+            for line in f:
+                tokens = line.replace('**', ' ').split()
+                if len(tokens) >= 3 and tokens[1] in columns:
+                    x[columns[tokens[1]]] = float(tokens[2])
+    if header.startswith('Optimal'):
+        status = OPTIMAL
+    elif 'infeasible' in header.lower():
+        status = INFEASIBLE
+    elif 'unbounded' in header.lower():
+        status = UNBOUNDED
+    elif header.startswith('Stopped') and 'objective value' in header:
+        status = FEASIBLE
+    else:
+        status = UNKNOWN
+    if status not in (OPTIMAL, FEASIBLE):
+        return Solution(status, None, None, tload, tsolve)
+    return Solution(status, model.sense*float(header.split()[-1]), x, tload, tsolve)
+
+
+def solve_gurobi(model, time_limit=None, verbose=True):
+    """Solve a model with Gurobi (gurobipy), writing an IIS to '<name>.ilp' if infeasible"""
+    import gurobipy as grb
+    import scipy.sparse
+    from gurobipy import GRB
+
+    tbeg = perf_counter()
+    lb, ub, obj, integer = model.columns()
+    rhs, sense = model.rows()
+    start, index, value = model.matrix(colwise=False)
+    mod = grb.Model(model.name)
+    mod.Params.OutputFlag = int(bool(verbose))
+    if time_limit is not None:
+        mod.Params.TimeLimit = time_limit
+    mod.ModelSense = GRB.MAXIMIZE if model.sense == MAXIMIZE else GRB.MINIMIZE
+    x = mod.addMVar(model.nvars, lb=lb, ub=ub, obj=obj, vtype=np.where(integer, GRB.INTEGER, GRB.CONTINUOUS))
+    A = scipy.sparse.csr_matrix((value, index, start), shape=(model.nconstrs, model.nvars))
+    mod.addMConstr(A, x, sense, rhs)
+    x0 = model.start()
+    x.Start = np.where(np.isnan(x0), GRB.UNDEFINED, x0)
+    mod.update()
+    tload = perf_counter() - tbeg
+
+    tbeg = perf_counter()
+    mod.optimize()
+    tsolve = perf_counter() - tbeg
+    if mod.status == GRB.OPTIMAL:
+        status = OPTIMAL
+    elif mod.status in (GRB.INFEASIBLE, GRB.INF_OR_UNBD):
+        status = INFEASIBLE
+        mod.computeIIS()
+        mod.write(f"{model.name}.ilp")
+    elif mod.status == GRB.UNBOUNDED:
+        status = UNBOUNDED
+    else:
+        status = FEASIBLE if mod.SolCount > 0 else UNKNOWN
+    if status not in (OPTIMAL, FEASIBLE):
+        return Solution(status, None, None, tload, tsolve)
+    return Solution(status, mod.ObjVal, np.array(x.X), tload, tsolve)
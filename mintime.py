@@ -0,0 +1,206 @@
+"""
+Minimum-time forward search.
+
+Instead of maximizing the summed speed over a fixed horizon (see `dprog.py`
+and `optim.py`), the states reachable at time steps j = 0, 1, ... are
+expanded forward with the transition tables of `trans.py` until the finish
+line is crossed. Per state (c, y, r, v) only the largest distance x is kept
+and states that cannot cross the finish line within the target time, even
+with the optimistic speeds of `lb.py`, are pruned. The target time is raised
+from the lower bound until the search succeeds, so the first finish found is
+minimal.
+
+Optionally, states dominated in (x, v) by a state with equal (c, y, r) are
+pruned, too. This is a heuristic: the speed update is not monotone (e.g. a
+faster dragster may lose motor speed later), so it may miss the optimum.
+"""
+
+import argparse
+
+from collections import namedtuple
+from itertools import product
+
+from trans import m, inputs, idx, frm, stp, phase, states, load_tables
+
+import numpy as np
+
+
+FINISH = 24832  # distance of the finish line
+
+# maximal number of time steps (race time up to 99.99)
+MAXSTEPS = 2994
+
+
+# SearchResult record
+#   ofs:       offset (in time steps) of game start relative to global frame counter
+#   nsteps:    finish time step (finish line crossed in frame frm(nsteps, ofs))
+#   lb:        lower bound of the finish time step
+#   x0:        start state (c, y, r, v)
+#   u:         input codes of time steps 1, ..., nsteps-1
+#   expanded:  number of expanded states (all searches)
+#   dominated: number of states pruned by dominance
+#   bounded:   number of states pruned by the finish time bound
+SearchResult = namedtuple('SearchResult', ['ofs', 'nsteps', 'lb', 'x0', 'u', 'expanded', 'dominated', 'bounded'])
+
+
+def bounds(kmax):
+    """Optimistic distances B[k, i] covered in k time steps from the states i = (c*5 + y)*254 + v
+
+    As in `lb.py`, the speed increases by at most 2 per time step up to the top
+    speed of the gear (plus 1) and does not change while the clutch is pressed
+    (at least one time step per gear change). The motor speed is ignored.
+    """
+    c, y, v = np.unravel_index(np.arange(2*5*254), (2, 5, 254))
+    top = ((1 << y) >> 1)*31 + ((1 << y) >> 2)
+    drive = (y > 0) & (c == 0)
+    S = []
+    for cl in range(2):
+        yn = np.where((c == 1) & (cl == 0), np.minimum(y+1, 4), y)
+        for vn, ok in ((v+2, drive & (v < top)), (v, ~drive | (v <= top)), (v-1, drive & (v >= 1))):
+            S.append(np.where(ok, (cl*5 + yn)*254 + vn, -1))
+    S = np.stack(S)
+    B = np.zeros((kmax+1, 2*5*254+1), dtype=np.int32)
+    B[:, -1] = -FINISH  # invalid successor
+    for k in range(1, kmax+1):
+        B[k, :-1] = v + B[k-1][S].max(axis=0)
+    return B[:, :-1]
+
+def lower_bound(B, start):
+    """Smallest number of time steps in which any of the start states may cross the finish line"""
+    k = np.flatnonzero(B[:, start].max(axis=1) >= FINISH)
+    return int(k[0]) if len(k) > 0 else None
+
+def search(ofs, target, T, B, pareto=False):
+    """Forward search for the first time step (<= target) at which the finish line is crossed
+
+    Returns the finish time step, the start state, the input codes and the
+    search statistics (or None for the finish time step, if there is no
+    finish within the target).
+    """
+    c, y, r, v = states()
+    bidx = np.append((c*5 + y)*254 + v, 0)
+    v = np.append(v, 0)
+    # largest distance per state (-1 if unreachable, always for the sink state m-1)
+    X = np.full(m, -1, dtype=np.int32)
+    X[[idx((c, 0, r, 0)) for c, r in product(range(2), range(0, 32, 3))]] = 0
+    parents = []
+    expanded = dominated = bounded = 0
+    for j in range(target):
+        # prune states that cannot cross the finish line in time
+        prune = (X >= 0) & (X + B[target-j][bidx] < FINISH)
+        bounded += int(np.count_nonzero(prune))
+        X[prune] = -1
+        # prune states dominated in (x, v) by a state with equal (c, y, r)
+        if pareto:
+            Xg = X[:m-1].reshape(-1, 254)
+            Xmax = np.full_like(Xg, -1)
+            Xmax[:, :-1] = np.maximum.accumulate(Xg[:, :0:-1], axis=1)[:, ::-1]  # max over greater speeds
+            prune = (Xg >= 0) & (Xmax >= Xg)
+            dominated += int(np.count_nonzero(prune))
+            Xg[prune] = -1
+        src = np.flatnonzero(X >= 0)
+        if len(src) == 0:
+            break
+        expanded += len(src)
+        # finish line crossed in the next time step
+        xn = X[src] + v[src]
+        if xn.max() >= FINISH:
+            i = int(src[np.argmax(xn)])
+            u = []
+            for dst, prev, a in reversed(parents):
+                k = np.searchsorted(dst, i)
+                u.append(int(a[k]))
+                i = int(prev[k])
+            x0 = tuple(int(s[i]) for s in states())
+            return j+1, x0, u[::-1], (expanded, dominated, bounded)
+        # successor states (keep largest distance)
+        Tp = T[phase(frm(j+1, ofs))]
+        dst = np.concatenate([Tp[a][src] for a in range(len(inputs))])
+        xn = np.tile(xn, len(inputs))
+        order = np.lexsort((-xn, dst))
+        dst, first = np.unique(dst[order], return_index=True)
+        sel = order[first]
+        if dst[-1] == m-1:  # busted
+            dst, sel = dst[:-1], sel[:-1]
+        parents.append((dst, np.tile(src, len(inputs))[sel], (sel // len(src)).astype(np.uint8)))
+        X = np.full(m, -1, dtype=np.int32)
+        X[dst] = xn[sel]
+    return None, None, None, (expanded, dominated, bounded)
+
+def solve(ofs, T=None, B=None, pareto=False, verbose=0):
+    """Minimal finish time step for offset ofs (raising the target time from the lower bound)"""
+    T = load_tables() if T is None else T
+    B = bounds(MAXSTEPS) if B is None else B
+    start = [(c*5 + 0)*254 + 0 for c in range(2)]
+    lb = lower_bound(B, start)
+    stats = np.zeros(3, dtype=np.int64)
+    for target in range(lb, MAXSTEPS+1):
+        nsteps, x0, u, st = search(ofs, target, T, B, pareto)
+        stats += st
+        if verbose > 0:
+            print(f"  ofs {ofs}  target {target:3d}  expanded {st[0]:9d}  {'finish' if nsteps else 'no finish'}")
+        if nsteps is not None:
+            return SearchResult(ofs, nsteps, lb, x0, u, *map(int, stats))
+    return SearchResult(ofs, None, lb, None, None, *map(int, stats))
+
+def mintimegen(ofs, x0, u):
+    """Input generator (per frame) of a search result"""
+    t = 1  # inputs start at frame 1
+    while stp(t, ofs) <= -x0[2]//3:
+        yield 0, 0
+        t += 1
+    while stp(t, ofs) < 0:
+        yield 1, 0
+        t += 1
+    yield 1, x0[0]
+    yield 1, x0[0]
+    for a in u:
+        yield inputs[a]
+        yield inputs[a]
+    while True:
+        yield inputs[u[-1]] if u else (1, 0)
+
+
+if __name__ == "__main__":
+
+    from pathlib import Path
+    from sim import sim, write_script
+    from time import perf_counter
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description="Compute minimum-time Dragster inputs.")
+    parser.add_argument("--offsets", default="0-7", help="Offsets (in time steps) of game start, e.g. '0-7' or '0,3'.")
+    parser.add_argument("--pareto", action="store_true", help="Prune states dominated in (x, v) for equal (c, y, r) (heuristic, may miss the optimum).")
+    parser.add_argument("--save", action="store_true", help="Save solutions to Stella script files.")
+    parser.add_argument("--verbose", action="store_true", help="Print every search.")
+    args = parser.parse_args()
+    offsets = []
+    for part in args.offsets.split(","):
+        lo, _, hi = part.partition("-")
+        offsets.extend(range(int(lo), int(hi or lo)+1))
+
+    tbeg = perf_counter()
+    T = load_tables()
+    B = bounds(MAXSTEPS)
+
+    print("ofs  lb   steps  frame  time   expanded  dominated    bounded  sim     secs")
+    print("----------------------------------------------------------------------------")
+    for ofs in offsets:
+        t0 = perf_counter()
+        res = solve(ofs, T, B, args.pareto, verbose=args.verbose)
+        if res.nsteps is None:
+            print(f"{ofs:<3d}  {res.lb:<3d}  -")
+            continue
+        # check with simulator
+        for s in sim(mintimegen(ofs, res.x0, res.u), 2*ofs):
+            if s.status == 0x0100 and s.frame > frm(0, ofs) or s.status == 0x0001:
+                break
+        check = 'ok' if (s.status, s.frame) == (0x0100, frm(res.nsteps, ofs)) else f"{s.frame}"
+        print(f"{ofs:<3d}  {res.lb:<3d}  {res.nsteps:<5d}  {frm(res.nsteps, ofs):<5d}  {s.time//100/100:4.2f}  "
+              f"{res.expanded:9d}  {res.dominated:9d}  {res.bounded:9d}  {check:6s}  {perf_counter()-t0:5.1f}")
+        if args.save:
+            # write Stella debug script
+            Path('scripts').mkdir(parents=True, exist_ok=True)  # create 'scripts' directory
+            with open(f"scripts/mintime{res.nsteps:03d}_ofs{2*ofs:X}.script", "w") as script:
+                write_script(script, mintimegen(ofs, res.x0, res.u), 2*ofs, frm(res.nsteps, ofs))
+    print(f"Total: {perf_counter()-tbeg:.1f}s")
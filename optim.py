@@ -1,9 +1,14 @@
 
 import argparse
-import gurobipy as grb
-from gurobipy import GRB
+import milp
+import numpy as np
+import store
+import telemetry
+from milp import MAXIMIZE, BINARY, INTEGER
 from pathlib import Path
-from sim import write_script
+from itertools import islice, takewhile
+from sim import read_script, sim, write_script
+from time import perf_counter
 
 
 # parse arguments
@@ -11,8 +16,13 @@ parser = argparse.ArgumentParser(description="Compute optimal Dragster inputs.")
 # parser.add_argument("--romname", default="Dragster (1980) (Activision)", help="The name of the ROM file.")
 parser.add_argument("--offset", type=int, default=0, help="Global frame counter offset for starting game.")
 parser.add_argument("--nsteps", type=int, default=177, help="Number of time steps to optimize.")
-parser.add_argument("--init", action="store_true", help="Specify an initial solution to the solver.")
+parser.add_argument("--init", nargs="?", const="default", metavar="SCRIPT", help="Warm start from the inputs of a Stella script (e.g. a saved dprog solution) or from the default inputs.")
 parser.add_argument("--save", action="store_true", help="Save best solution to Stella script file.")
+parser.add_argument("--solver", choices=milp.SOLVERS, default="highs", help="MILP solver backend.")
+parser.add_argument("--time-limit", type=float, default=None, help="Solver time limit (in seconds).")
+parser.add_argument("--write", metavar="FILE", default=None, help="Write the model to an LP/MPS file (and exit).")
+store.add_arguments(parser)
+telemetry.add_arguments(parser)
 args = parser.parse_args()
 
 
@@ -28,6 +38,7 @@ args = parser.parse_args()
 offset = args.offset  # offset (in time steps) of game start relative to global frame counter [0-7]
 # n = 66  # number of time steps
 n = args.nsteps  # number of time steps (default 177 corresponds to a 5.57 finish time)
+tel = telemetry.from_args(args, solver="optim", backend=args.solver, offset=offset, nsteps=n)
 
 def frame(j, offset):
     """Convert time step j to in-game frame number."""
@@ -38,69 +49,167 @@ def step(frame, offset):
     return (frame-161)//2 - offset + 10
 
 
+def trace_steps(inputs):
+    """Inputs u[th][j], u[cl][j] of all time steps from inputs (th, cl) per frame 0, 1, 2, ..."""
+    inputs = list(islice(inputs, frame(n-1, offset)+1))
+    inputs += inputs[-1:]*(frame(n-1, offset)+1-len(inputs))  # hold last inputs
+    return [[inputs[frame(j, offset)][k] for j in range(n)] for k in range(2)]
+
+def stepgen(uth, ucl):
+    """Input generator (per frame) from inputs per time step"""
+    th = 0
+    cl = 0
+    t = 1  # inputs start at frame 1
+    while True:
+        j = step(t, offset)
+        if 0 <= j < n:
+            th = int(uth[j])
+            cl = int(ucl[j])
+        yield th, cl
+        t += 1
+
+def prerace(r):
+    """Throttle inputs of time steps 0, ..., 9 reaching motor speed r at time step 9 (without clamping)"""
+    k = min(r//3, 10)
+    th0 = 1 - k % 2
+    a = (9 + k - th0)//2
+    return [th0] + [1]*a + [0]*(9-a)
+
+def replay(uth, ucl):
+    """Values of all model variables for the given inputs (per time step).
+
+    The dynamics are evaluated as defined by the model constraints below. The
+    throttle is set where it has no effect (see constraint SB) and where the
+    simulator would clamp the motor speed at 0 (which the model cannot
+    represent), so the values are a feasible solution of the model.
+    """
+    val = dict(
+        u=np.array([uth, ucl], dtype=np.int64), y=np.zeros((5, n), dtype=np.int64), yc=np.zeros(n, dtype=np.int64),
+        yr=np.zeros((5, n), dtype=np.int64), r=np.zeros(n, dtype=np.int64), rd=np.zeros((2, n), dtype=np.int64),
+        c=np.zeros(n, dtype=np.int64), vr=np.zeros((5, n), dtype=np.int64), v=np.zeros(n, dtype=np.int64),
+        vd=np.zeros((2, n), dtype=np.int64), rv=np.zeros(n, dtype=np.int64))
+    gear = 0
+    for j in range(n):
+        th, cl = val['u'][:, j]
+        clprev = val['u'][1, j-1] if j > 0 else 0
+        if j >= 10:
+            val['yc'][j] = clprev == 1 and cl == 0
+            gear = min(gear + val['yc'][j], 4)
+        val['y'][gear, j] = 1
+        if j == 0:
+            val['yr'][0, j] = 1
+            val['rd'][0, j] = th
+        else:
+            val['yr'][0, j] = val['y'][0, j] | clprev
+            val['yr'][1:, j] = val['y'][1:, j] * (1-clprev)
+            th |= val['yr'][1:, j] @ ~mask[:, j]
+            # motor speed decrement (would be clamped at 0)
+            if val['r'][j-1] - val['rv'][j-1] - 3*val['yr'][0, j] - val['yr'][1:, j] @ mask[:, j] < 0:
+                th = 1
+            val['u'][0, j] = th
+            val['rd'][0, j] = val['yr'][0, j]*(2*th-1)
+        val['rd'][1, j] = (val['yr'][1:, j] @ mask[:, j])*(2*th-1)
+        val['r'][j] = (val['r'][j-1] - val['rv'][j-1] if j > 0 else 0) + 3*val['rd'][0, j] + val['rd'][1, j]
+        if j == 0:
+            continue
+        val['c'][j] = val['r'][j] >= 20
+        val['vr'][1:, j] = val['yr'][1:, j]*(np.array([1, 2, 4, 8])*val['r'][j] + np.array([0, 1, 2, 4])*val['c'][j])
+        vrsum, vprev, drive = val['vr'][1:, j].sum(), val['v'][j-1], 1-val['yr'][0, j]
+        val['vd'][0, j] = drive and vprev < vrsum
+        val['vd'][1, j] = drive and vprev > vrsum
+        val['rv'][j] = drive and vprev < vrsum-15
+        val['v'][j] = vprev + 2*val['vd'][0, j] - val['vd'][1, j]
+    return val
+
+
+def report(val):
+    """Print the values of the model variables (and save the inputs to a Stella script file)"""
+    print("j    frame  th  cl  y  yc  yr  rd  r   c  vr   vd  v    rv")
+    for j in range(n):
+        print(f"{j:<3d}  "
+              f"{frame(j, offset):<5d}  "
+              f"{val['u'][0, j]:<2d}  "
+              f"{val['u'][1, j]:<2d}  "
+              f"{sum(i*val['y'][i, j] for i in range(5)):d}  "
+              f"{val['yc'][j]:<2d}  "
+              f"{sum(i*val['yr'][i, j] for i in range(5)):<2d}  "
+              f"{3*val['rd'][0, j]+val['rd'][1, j]:2d}  "
+              f"{val['r'][j]:<2d}  "
+              f"{val['c'][j]:d}  "
+              f"{sum(val['vr'][i, j] for i in range(1, 5)):<3d}  "
+              f"{2*val['vd'][0, j]-val['vd'][1, j]:2d}  "
+              f"{val['v'][j]:<3d}  "
+              f"{val['rv'][j]:d}")
+
+    if args.save:
+        # write Stella debug script
+        print(f"Writing script file 'opt{n:03d}_ofs{2*offset:X}'.")
+        Path('scripts').mkdir(parents=True, exist_ok=True)  # create 'scripts' directory
+        with open(f"scripts/opt{n:03d}_ofs{2*offset:X}.script", "w") as script:
+            write_script(script, stepgen(val['u'][0], val['u'][1]), 2*offset, frame(n, offset)-1)
+
+
+# stored result (only optimal solutions are stored, the model is defined in this file)
+rs = store.from_args(args)
+key = rs.key("optim", dict(offset=offset, nsteps=n), code=[Path(__file__).read_text()])
+res = rs.get(key) if args.write is None else None
+tel.record('store', key=key, hit=res is not None)
+if res is not None:
+    print(f"Loaded stored result {key[:12]} ({res.meta['created']}).")
+    report(res.states)
+    tel.close(status=milp.OPTIMAL, objective=res.objective)
+    raise SystemExit()
+
+
 # model
+#
+#  * all quantities are arrays over the time steps j = 0, ..., n-1
+#  * values that are constant in the original formulation (e.g. the gear
+#    during the first 10 time steps) are variables with fixed bounds
+#
 
-mod = grb.Model("dragster")
+tbeg = perf_counter()
+mod = milp.Model("dragster", MAXIMIZE)
 
-# objective sense
-mod.modelSense = GRB.MAXIMIZE
+J = np.arange(n)
+I = np.arange(5)[:, None]
 
 # inputs (throttle, clutch)
-u = [[mod.addVar(vtype=GRB.BINARY, name=f"u(th,{j})") for j in range(n)],
-     [mod.addVar(vtype=GRB.BINARY, name=f"u(cl,{j})") for j in range(n)]]
+u = mod.add_vars((2, n), BINARY, name="u")
 # ***DEBUG***
 # inputs for x=24884 in 5.57
 # u = [[0 if j in (1, 3, 16, 27, 28, 44, 154, 162, 170) else 1 for j in range(n)],
 #      [1 if j in (9, 26, 43, 63, 85, 96, 109, 118, 127, 153, 154, 161, 162, 169, 170) else 0 for j in range(n)]]
 # ***ENDEBUG***
 
-# gear variables (N, 1, 2, 3, 4)
-y = [[1]*10 + [mod.addVar(vtype=GRB.BINARY, name=f"y(0,{j})") for j in range(10,n)],
-     [0]*10 + [mod.addVar(vtype=GRB.BINARY, name=f"y(1,{j})") for j in range(10,n)],
-     [0]*10 + [mod.addVar(vtype=GRB.BINARY, name=f"y(2,{j})") for j in range(10,n)],
-     [0]*10 + [mod.addVar(vtype=GRB.BINARY, name=f"y(3,{j})") for j in range(10,n)],
-     [0]*10 + [mod.addVar(vtype=GRB.BINARY, name=f"y(4,{j})") for j in range(10,n)]]
+# gear variables (N, 1, 2, 3, 4), gear N for j < 10
+y = mod.add_vars((5, n), BINARY, lb=(I == 0) & (J < 10), ub=(I == 0) | (J >= 10), name="y")
 # gear switch flag
-yc = [None]*10 + [mod.addVar(vtype=GRB.BINARY, name=f"yc({j})") for j in range(10,n)]
+yc = mod.add_vars(n, BINARY, ub=J >= 10, name="yc")
 # gear/motor speed coupling
-yr = [[1] + [mod.addVar(vtype=GRB.BINARY, name=f"yr0({j})") for j in range(1,n)],
-      [0] + [mod.addVar(vtype=GRB.BINARY, name=f"yr1({j})") for j in range(1,n)],
-      [0] + [mod.addVar(vtype=GRB.BINARY, name=f"yr2({j})") for j in range(1,n)],
-      [0] + [mod.addVar(vtype=GRB.BINARY, name=f"yr3({j})") for j in range(1,n)],
-      [0] + [mod.addVar(vtype=GRB.BINARY, name=f"yr4({j})") for j in range(1,n)]]
+yr = mod.add_vars((5, n), BINARY, lb=(I == 0) & (J < 1), ub=(I == 0) | (J >= 1), name="yr")
 
 # motor speed
-r = [mod.addVar(vtype=GRB.INTEGER, lb=0, ub=31, name=f"r({j})") for j in range(n)]
+r = mod.add_vars(n, INTEGER, lb=0, ub=31, name="r")
 # motor speed increment (throttle)
-rd = [[mod.addVar(vtype=GRB.INTEGER, lb=-1, ub=1, name=f"rd(0,{j})") for j in range(n)],
-      [mod.addVar(vtype=GRB.INTEGER, lb=-1, ub=1, name=f"rd(1,{j})") for j in range(n)]]
+rd = mod.add_vars((2, n), INTEGER, lb=-1, ub=1, name="rd")
 
 # turbocharger flag (c == r >= 20)
-c = [0] + [mod.addVar(vtype=GRB.BINARY, name=f"c({j})") for j in range(1,n)]
+c = mod.add_vars(n, BINARY, ub=J >= 1, name="c")
 
 # ref speed (per gear)
-vr = [[0]*n,
-      [0] + [mod.addVar(vtype=GRB.INTEGER, name=f"vr(1,{j})") for j in range(1,n)],
-      [0] + [mod.addVar(vtype=GRB.INTEGER, name=f"vr(2,{j})") for j in range(1,n)],
-      [0] + [mod.addVar(vtype=GRB.INTEGER, name=f"vr(3,{j})") for j in range(1,n)],
-      [0] + [mod.addVar(vtype=GRB.INTEGER, name=f"vr(4,{j})") for j in range(1,n)]]
+vr = mod.add_vars((5, n), INTEGER, ub=np.where((I >= 1) & (J >= 1), np.inf, 0), name="vr")
 
 # dragster speed
-v = [0]*10 + [mod.addVar(vtype=GRB.INTEGER, obj=1.0 if j<n-1 else 0.0, name=f"v({j})") for j in range(10,n)]
+v = mod.add_vars(n, INTEGER, ub=np.where(J >= 10, np.inf, 0), obj=(J >= 10) & (J < n-1), name="v")
 # dragster speed increment
-vd = [[None] + [mod.addVar(vtype=GRB.BINARY, name=f"vd(0,{j})") for j in range(1,n)],
-      [None] + [mod.addVar(vtype=GRB.BINARY, name=f"vd(1,{j})") for j in range(1,n)]]
+vd = mod.add_vars((2, n), BINARY, ub=J >= 1, name="vd")
 # motor speed increment (speed difference)
-rv = [0] + [mod.addVar(vtype=GRB.BINARY, name=f"rv({j})") for j in range(1,n)]
-
-if args.init:
-    uth = [0 if j in (0, 1, 2, 3, 16, 27, 28, 44, 154, 162, 170) else 1 for j in range(n)]
-    ucl = [1 if j in (9, 26, 43, 63, 85, 96, 109, 118, 127, 153, 154, 161, 162, 169, 170) else 0 for j in range(n)]
-    for j in range(0, n):
-        u[0][j].start = uth[j]
-        u[1][j].start = ucl[j]
+rv = mod.add_vars(n, BINARY, ub=J >= 1, name="rv")
 
-mod.update()
+# time steps j-1 and j (for j = 1, ..., n-1 and j = 10, ..., n-1)
+P, K = slice(0, n-1), slice(1, n)
+P10, K10 = slice(9, n-1), slice(10, n)
 
 # gear switching
 #
@@ -109,39 +218,35 @@ mod.update()
 #   y[i][j] = y[i-1][j-1]    if yc[j]==1
 #   y[i][j] = y[i][j-1]      otherwise
 #
-for j in range(10, n):
-    mod.addConstr(yc[j], GRB.LESS_EQUAL, u[1][j-1], f"Sc1({j}")
-    mod.addConstr(yc[j], GRB.LESS_EQUAL, 1-u[1][j], f"Sc2({j}")
-    mod.addConstr(yc[j], GRB.GREATER_EQUAL, u[1][j-1]-u[1][j], f"Sc3({j}")
-    # y[0]
-    mod.addConstr(y[0][j], GRB.GREATER_EQUAL, y[0][j-1]-yc[j], f"S1(0,{j})")
-    mod.addConstr(y[0][j], GRB.LESS_EQUAL, y[0][j-1]+yc[j], f"S3(0,{j})")
-    mod.addConstr(y[0][j], GRB.LESS_EQUAL, 1-yc[j], f"S4(0,{j})")
-    # y[1] - y[3]
-    for i in range(1, 4):
-        mod.addConstr(y[i][j], GRB.GREATER_EQUAL, y[i][j-1]-yc[j], f"S1({i},{j})")
-        mod.addConstr(y[i][j], GRB.GREATER_EQUAL, y[i-1][j-1]-1+yc[j], f"S2({i},{j})")
-        mod.addConstr(y[i][j], GRB.LESS_EQUAL, y[i][j-1]+yc[j], f"S3({i},{j})")
-        mod.addConstr(y[i][j], GRB.LESS_EQUAL, y[i-1][j-1]+1-yc[j], f"S4({i},{j})")
-    # y[4]
-    mod.addConstr(y[4][j], GRB.GREATER_EQUAL, y[4][j-1]-yc[j], f"S1(4,{j})")
-    mod.addConstr(y[4][j], GRB.GREATER_EQUAL, y[3][j-1]+y[4][j-1]-1+yc[j], f"S2(4,{j})")
-    mod.addConstr(y[4][j], GRB.LESS_EQUAL, y[4][j-1]+yc[j], f"S3(4,{j})")
-    mod.addConstr(y[4][j], GRB.LESS_EQUAL, y[3][j-1]+y[4][j-1]+1-yc[j], f"S4(4,{j})")
+mod.add_constrs(yc[K10] <= u[1, P10], "Sc1")
+mod.add_constrs(yc[K10] <= 1-u[1, K10], "Sc2")
+mod.add_constrs(yc[K10] >= u[1, P10]-u[1, K10], "Sc3")
+# y[0]
+mod.add_constrs(y[0, K10] >= y[0, P10]-yc[K10], "S1_0")
+mod.add_constrs(y[0, K10] <= y[0, P10]+yc[K10], "S3_0")
+mod.add_constrs(y[0, K10] <= 1-yc[K10], "S4_0")
+# y[1] - y[3]
+mod.add_constrs(y[1:4, K10] >= y[1:4, P10]-yc[K10], "S1")
+mod.add_constrs(y[1:4, K10] >= y[0:3, P10]-1+yc[K10], "S2")
+mod.add_constrs(y[1:4, K10] <= y[1:4, P10]+yc[K10], "S3")
+mod.add_constrs(y[1:4, K10] <= y[0:3, P10]+1-yc[K10], "S4")
+# y[4]
+mod.add_constrs(y[4, K10] >= y[4, P10]-yc[K10], "S1_4")
+mod.add_constrs(y[4, K10] >= y[3, P10]+y[4, P10]-1+yc[K10], "S2_4")
+mod.add_constrs(y[4, K10] <= y[4, P10]+yc[K10], "S3_4")
+mod.add_constrs(y[4, K10] <= y[3, P10]+y[4, P10]+1-yc[K10], "S4_4")
 
 # gear/motor speed coupling
 #
 #   yr[0][j] = y[0][j]==1 or u[cl][j-1]==1
 #   yr[i][j] = y[i][j]==1 and u[cl][j-1]==0
 #
-for j in range(1, n):
-    mod.addConstr(yr[0][j], GRB.GREATER_EQUAL, y[0][j], f"YR1(0,{j})")
-    mod.addConstr(yr[0][j], GRB.GREATER_EQUAL, u[1][j-1], f"YR2(0,{j})")
-    mod.addConstr(yr[0][j], GRB.LESS_EQUAL, y[0][j] + u[1][j-1], f"YR3(0,{j})")
-    for i in range(1, 5):
-        mod.addConstr(yr[i][j], GRB.LESS_EQUAL, y[i][j], f"YR1({i},{j})")
-        mod.addConstr(yr[i][j], GRB.LESS_EQUAL, 1-u[1][j-1], f"YR2(0,{j})")
-        mod.addConstr(yr[i][j], GRB.GREATER_EQUAL, y[i][j] - u[1][j-1], f"YR3({i},{j})")
+mod.add_constrs(yr[0, K] >= y[0, K], "YR1_0")
+mod.add_constrs(yr[0, K] >= u[1, P], "YR2_0")
+mod.add_constrs(yr[0, K] <= y[0, K]+u[1, P], "YR3_0")
+mod.add_constrs(yr[1:5, K] <= y[1:5, K], "YR1")
+mod.add_constrs(yr[1:5, K] <= 1-u[1, P], "YR2")
+mod.add_constrs(yr[1:5, K] >= y[1:5, K]-u[1, P], "YR3")
 
 # motor speed
 #
@@ -156,32 +261,26 @@ for j in range(1, n):
 #   r[j] = r[j-1] + 3*rd[0] + rd[1] - rv[j-1]
 #
 rpm_skip = [0x00, 0x00, 0x02, 0x06, 0x0E]
-for j in range(n):
-    if j == 0:
-        mod.addConstr(rd[0][j], GRB.EQUAL, u[0][j], f"Rd(0,{j})")
-    else:
-        mod.addConstr(rd[0][j], GRB.LESS_EQUAL, -yr[0][j] + 2*u[0][j], f"Rd1(0,{j})")
-        mod.addConstr(rd[0][j], GRB.GREATER_EQUAL, yr[0][j] + 2*u[0][j] - 2, f"Rd2(0,{j})")
-        mod.addConstr(rd[0][j], GRB.LESS_EQUAL, yr[0][j], f"Rd3(0,{j})")
-        mod.addConstr(rd[0][j], GRB.GREATER_EQUAL, -yr[0][j], f"Rd3(0,{j})")
-    Rdrhs = (2*u[0][j], 2*u[0][j]-2, 0, 0)
-    for i in range(1, 5):
-        if (frame(j, offset) & rpm_skip[i]) == 0:
-            Rdrhs = (-yr[i][j]+Rdrhs[0], yr[i][j]+Rdrhs[1], yr[i][j]+Rdrhs[2], -yr[i][j]+Rdrhs[3])
-    mod.addConstr(rd[1][j], GRB.LESS_EQUAL, Rdrhs[0], f"Rd1(1,{j})")
-    mod.addConstr(rd[1][j], GRB.GREATER_EQUAL, Rdrhs[1], f"Rd2(1,{j})")
-    mod.addConstr(rd[1][j], GRB.LESS_EQUAL, Rdrhs[2], f"Rd3(1,{j})")
-    mod.addConstr(rd[1][j], GRB.GREATER_EQUAL, Rdrhs[3], f"Rd3(1,{j})")
-    # mod.addConstr(r[j], GRB.EQUAL, (r[j-1] if j > 0 else 0) + 3*rd[0][j] + rd[1][j], f"R({j})")
-    mod.addConstr(r[j], GRB.EQUAL, (r[j-1] if j > 0 else 0) + 3*rd[0][j] + rd[1][j] - (rv[j-1] if j > 0 else 0), f"R({j})")
+mask = np.array([[(frame(j, offset) & rpm_skip[i]) == 0 for j in range(n)] for i in range(1, 5)])
+mod.add_constrs(rd[0, 0] == u[0, 0], "Rd_0")
+mod.add_constrs(rd[0, K] <= -yr[0, K]+2*u[0, K], "Rd1_0")
+mod.add_constrs(rd[0, K] >= yr[0, K]+2*u[0, K]-2, "Rd2_0")
+mod.add_constrs(rd[0, K] <= yr[0, K], "Rd3_0")
+mod.add_constrs(rd[0, K] >= -yr[0, K], "Rd4_0")
+yrm = (yr[1:5]*mask).sum(axis=0)
+mod.add_constrs(rd[1] <= 2*u[0]-yrm, "Rd1_1")
+mod.add_constrs(rd[1] >= 2*u[0]-2+yrm, "Rd2_1")
+mod.add_constrs(rd[1] <= yrm, "Rd3_1")
+mod.add_constrs(rd[1] >= -yrm, "Rd4_1")
+mod.add_constrs(r[0] == 3*rd[0, 0]+rd[1, 0], "R_0")
+mod.add_constrs(r[K] == r[P]+3*rd[0, K]+rd[1, K]-rv[P], "R")
 
 # turbocharger flag
 #
 #   (r[j]-19)/12 <= c[j] <= r[j]/20
 #
-for j in range(1, n):
-    mod.addConstr(c[j], GRB.LESS_EQUAL, r[j]/20, f"Cub({j})")
-    mod.addConstr(c[j], GRB.GREATER_EQUAL, (r[j]-19)/12, f"Clb({j})")
+mod.add_constrs(c[K] <= r[K]/20, "Cub")
+mod.add_constrs(c[K] >= (r[K]-19)/12, "Clb")
 
 # ref speed
 #
@@ -191,23 +290,11 @@ for j in range(1, n):
 #   vr[3][j] = 4*r[j] + 2*c[j]    if yr[3][j] = 1
 #   vr[4][j] = 8*r[j] + 4*c[j]    if yr[4][j] = 1
 #
-for j in range(1, n):
-    # y = 1
-    mod.addConstr(vr[1][j], GRB.LESS_EQUAL, 31*yr[1][j], "")
-    mod.addConstr(vr[1][j], GRB.LESS_EQUAL, r[j], "")
-    mod.addConstr(vr[1][j], GRB.GREATER_EQUAL, r[j]-31*(1-yr[1][j]))
-    # y = 2
-    mod.addConstr(vr[2][j], GRB.LESS_EQUAL, 63*yr[2][j], "")
-    mod.addConstr(vr[2][j], GRB.LESS_EQUAL, 2*r[j]+c[j], "")
-    mod.addConstr(vr[2][j], GRB.GREATER_EQUAL, 2*r[j]+c[j]-63*(1-yr[2][j]))
-    # y = 3
-    mod.addConstr(vr[3][j], GRB.LESS_EQUAL, 126*yr[3][j], "")
-    mod.addConstr(vr[3][j], GRB.LESS_EQUAL, 4*r[j]+2*c[j], "")
-    mod.addConstr(vr[3][j], GRB.GREATER_EQUAL, 4*r[j]+2*c[j]-126*(1-yr[3][j]))
-    # y = 4
-    mod.addConstr(vr[4][j], GRB.LESS_EQUAL, 252*yr[4][j], "")
-    mod.addConstr(vr[4][j], GRB.LESS_EQUAL, 8*r[j]+4*c[j], "")
-    mod.addConstr(vr[4][j], GRB.GREATER_EQUAL, 8*r[j]+4*c[j]-252*(1-yr[4][j]))
+vmax = np.array([31, 63, 126, 252])[:, None]
+vref = np.array([1, 2, 4, 8])[:, None]*r[K] + np.array([0, 1, 2, 4])[:, None]*c[K]
+mod.add_constrs(vr[1:5, K] <= vmax*yr[1:5, K], "VR1")
+mod.add_constrs(vr[1:5, K] <= vref, "VR2")
+mod.add_constrs(vr[1:5, K] >= vref-vmax*(1-yr[1:5, K]), "VR3")
 
 # dragster speed
 #
@@ -218,80 +305,90 @@ for j in range(1, n):
 #
 #   rv[j] = 1       if yr[0][j]==0 and v[j-1] < vr[j]-15
 #
-for j in range(1, n):
-    # vd[0] (increment)
-    mod.addConstr(vd[0][j], GRB.LESS_EQUAL, 1-yr[0][j], "")
-    mod.addConstr(v[j-1] + 252*(yr[0][j]+vd[0][j]), GRB.GREATER_EQUAL, vr[1][j]+vr[2][j]+vr[3][j]+vr[4][j], "")
-    mod.addConstr(v[j-1] - 253*(1-vd[0][j]), GRB.LESS_EQUAL, vr[1][j]+vr[2][j]+vr[3][j]+vr[4][j]-1, "")
-    # vd[1] (decrement)
-    mod.addConstr(vd[1][j], GRB.LESS_EQUAL, 1-yr[0][j], "")
-    mod.addConstr(v[j-1] - 252*(yr[0][j]+vd[1][j]), GRB.LESS_EQUAL, vr[1][j]+vr[2][j]+vr[3][j]+vr[4][j], "")
-    mod.addConstr(v[j-1] + 253*(1-vd[1][j]), GRB.GREATER_EQUAL, vr[1][j]+vr[2][j]+vr[3][j]+vr[4][j]+1, "")
-    # v (speed)
-    mod.addConstr(v[j], GRB.EQUAL, v[j-1] + 2*vd[0][j] - vd[1][j], "")
-    # rv (motor speed increment)
-    mod.addConstr(rv[j], GRB.LESS_EQUAL, 1-yr[0][j], "")
-    mod.addConstr(v[j-1] + 237*(yr[0][j]+rv[j]), GRB.GREATER_EQUAL, vr[1][j]+vr[2][j]+vr[3][j]+vr[4][j]-15, "")
-    mod.addConstr(v[j-1] - 268*(1-rv[j]), GRB.LESS_EQUAL, vr[1][j]+vr[2][j]+vr[3][j]+vr[4][j]-16, "")
+#   big-M values from the ranges 0 <= vr[j] <= 252 and 0 <= v[j] <= 253 (v
+#   increases by 2 up to vr[j]+1)
+#
+vrsum = vr[1:5, K].sum(axis=0)
+vrmax = int(vmax[-1, 0])  # largest reference speed
+vtop = vrmax+1            # largest speed
+# vd[0] (increment)
+mod.add_constrs(vd[0, K] <= 1-yr[0, K], "VD1_0")
+mod.add_constrs(v[P]+vrmax*(yr[0, K]+vd[0, K]) >= vrsum, "VD2_0")
+mod.add_constrs(v[P]-(vtop+1)*(1-vd[0, K]) <= vrsum-1, "VD3_0")
+# vd[1] (decrement)
+mod.add_constrs(vd[1, K] <= 1-yr[0, K], "VD1_1")
+mod.add_constrs(v[P]-vtop*(yr[0, K]+vd[1, K]) <= vrsum, "VD2_1")
+mod.add_constrs(v[P]+(vrmax+1)*(1-vd[1, K]) >= vrsum+1, "VD3_1")
+# v (speed)
+mod.add_constrs(v[K] == v[P]+2*vd[0, K]-vd[1, K], "V")
+# rv (motor speed increment)
+mod.add_constrs(rv[K] <= 1-yr[0, K], "RV1")
+mod.add_constrs(v[P]+(vrmax-15)*(yr[0, K]+rv[K]) >= vrsum-15, "RV2")
+mod.add_constrs(v[P]-(vtop+16)*(1-rv[K]) <= vrsum-16, "RV3")
 
 # symmetry breaking
 #
 #   u[th][j] = 1    if sum(yr[i][j]*(j&mask[i]=1),i=1,..,4)==1
 #
-for j in range(1, n):
-    Srhs = 0
-    for i in range(1, 5):
-        if (frame(j, offset) & rpm_skip[i]) != 0:
-            Srhs = Srhs + yr[i][j]
-    mod.addConstr(u[0][j], GRB.GREATER_EQUAL, Srhs, f"S{j}")
-
-
-status = mod.optimize()
-
-if (mod.status == GRB.OPTIMAL) or (mod.status == GRB.INTERRUPTED) or (mod.status == GRB.SUBOPTIMAL):
-    print("j    frame  th  cl  y  yc  yr  rd  r   c  vr   vd  v    rv")
-    for j in range(n):
-        print(f"{j:<3d}  "
-              f"{frame(j, offset):<5d}  "
-              f"{int(u[0][j].x):<2d}  "
-              f"{int(u[1][j].x):<2d}  "
-              f"{sum(i*(int(y[i][j].x) if j >= 10 else y[i][j]) for i in range(5)):d}  "
-              f"{int(yc[j].x) if j >= 10 else 0:<2d}  "
-              f"{sum(i*(int(yr[i][j].x) if j >= 1 else yr[i][j]) for i in range(5)):<2d}  "
-              f"{3*int(rd[0][j].x)+int(rd[1][j].x):2d}  "
-              f"{int(r[j].x):<2d}  "
-              f"{int(c[j].x) if j >= 1 else c[j]:d}  "
-              f"{sum(int(vr[i][j].x) if j >= 1 else vr[i][j] for i in range(1, 5)):<3d}  "
-              f"{2*(int(vd[0][j].x) if j >= 1 else 0)-(int(vd[1][j].x) if j >= 1 else 0):2d}  "
-              f"{int(v[j].x) if j >= 10 else v[j]:<3d}  "
-              f"{int(rv[j].x) if j >= 1 else rv[j]:d}")
-
-    # input generator from optimal solution
-    def optgen(offset):
-        th = 0
-        cl = 0
-        t = 1  # inputs start at frame 1
-        while True:
-            j = step(t, offset)
-            if j >= 0:
-                th = int(u[0][j].x)
-                cl = int(u[1][j].x)
-                # th = int(u[0][j])
-                # cl = int(u[1][j])
-            yield th, cl
-            t += 1
-
-    if args.save:
-        # write Stella debug script
-        print(f"Writing script file 'opt{n:03d}_ofs{2*offset:X}'.")
-        Path('scripts').mkdir(parents=True, exist_ok=True)  # create 'scripts' directory
-        with open(f"scripts/opt{n:03d}_ofs{2*offset:X}.script", "w") as script:
-            write_script(script, optgen(offset), 2*offset, frame(n, offset)-1)
-
-elif (mod.status == GRB.INF_OR_UNBD) or (mod.status == GRB.INFEASIBLE):
-    mod.computeIIS()
-    mod.write("%s.ilp" % "tmp")
-    pass
-
+mod.add_constrs(u[0, K] >= (yr[1:5, K]*~mask[:, K]).sum(axis=0), "SB")
 
+tbuild = perf_counter()-tbeg
+print(f"Model build: {tbuild:.3f}s ({mod.nvars} variables, {mod.nconstrs} constraints)")
+tel.record('phase', name="build", seconds=round(tbuild, 6), variables=mod.nvars, constraints=mod.nconstrs)
 
+# warm start
+if args.init:
+    tbeg = perf_counter()
+    if args.init == "default":
+        uth = [0 if j in (0, 1, 2, 3, 16, 27, 28, 44, 154, 162, 170) else 1 for j in range(n)]
+        ucl = [1 if j in (9, 26, 43, 63, 85, 96, 109, 118, 127, 153, 154, 161, 162, 169, 170) else 0 for j in range(n)]
+    else:
+        with open(args.init) as script:
+            inputs, _ = read_script(script)
+        # start frame offset (from the restart frame, as in validate.py)
+        restart = np.flatnonzero(inputs[:, 2])
+        if len(restart) == 0:
+            parser.error(f"no game start in script '{args.init}'")
+        if int(restart[0]) - 1 != 2*offset:
+            parser.error(f"script '{args.init}' starts at offset {(int(restart[0])-1)/2:g} (expected --offset {offset})")
+        uth, ucl = trace_steps(inputs[:, :2].tolist())
+    # simulate inputs (up to the finish line)
+    states = {s.frame: s for s in takewhile(lambda s: s.frame <= frame(n-1, offset), sim(stepgen(uth, ucl), 2*offset))}
+    # replace inputs before the start by inputs reaching the same motor speed
+    if frame(9, offset) in states:
+        uth = prerace(states[frame(9, offset)].r) + list(uth[10:])
+    start = replay(uth, ucl)
+    for name, var in dict(u=u, y=y, yc=yc, yr=yr, r=r, rd=rd, c=c, vr=vr, v=v, vd=vd, rv=rv).items():
+        mod.set_start(var, start[name])
+    # compare with simulation
+    diff = [j for j in range(9, n) if frame(j, offset) in states and
+            (states[frame(j, offset)].v, states[frame(j, offset)].r) != (start['v'][j], start['r'][j]-start['rv'][j])]
+    nbounds, nconstrs = mod.violations(mod.start())
+    print(f"Warm start: {nbounds} bounds and {nconstrs} constraints violated"
+          f"{f', differs from simulation at time step {diff[0]} (frame {frame(diff[0], offset)})' if diff else ''}")
+    tel.record('phase', name="warm start", seconds=round(perf_counter()-tbeg, 6), bounds=nbounds, constraints=nconstrs)
+
+if args.write:
+    mod.write(args.write)
+    print(f"Wrote model file '{args.write}'.")
+    tel.close()
+    raise SystemExit()
+
+with tel.hot():
+    sol = milp.solve(mod, args.solver, args.time_limit)
+print(f"Solver ({args.solver}): {sol.status}, load: {sol.load:.3f}s, solve: {sol.solve:.3f}s")
+tel.record('phase', name="load", seconds=round(sol.load, 6))
+tel.record('phase', name="solve", seconds=round(sol.solve, 6), status=sol.status, objective=sol.objective)
+
+if sol.status in (milp.OPTIMAL, milp.FEASIBLE):
+    # integral solution values
+    def value(e):
+        return np.rint(e.value(sol.x)).astype(int)
+
+    val = dict(u=u, y=y, yc=yc, yr=yr, rd=rd, r=r, c=c, vr=vr, v=v, vd=vd, rv=rv)
+    val = {name: value(e) for name, e in val.items()}
+    if sol.status == milp.OPTIMAL:
+        rs.put(key, 2*val['u'][0]+val['u'][1], sol.objective, val, solver="optim", params=dict(offset=offset, nsteps=n), backend=args.solver)
+    report(val)
+
+tel.close(status=sol.status, objective=sol.objective)
@@ -1,34 +1,137 @@
 
 import argparse
+import hashlib
 import jinja2
+import numpy as np
+import os
+import struct
 
 from base64 import b64encode
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
+from io import BytesIO
 from itertools import islice
 from pathlib import Path
 
 from sim import parse_dump
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 
 # parse arguments
 parser = argparse.ArgumentParser(description="Create an interactive SVG.")
 parser.add_argument("runid", help="The identifier of the run.")
 parser.add_argument("--romname", default="Dragster (1980) (Activision)", help="The name of the ROM file.")
 parser.add_argument("--offset", type=int, default=0, help="Skip the first <n> frames.")
+parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of threads for encoding frames.")
+parser.add_argument("--tile-area", type=float, default=0.25, help="Max. fraction of changed pixels for storing a frame as diff tile (requires Pillow, 0 disables tiles).")
 args = parser.parse_args()
 
+# frame image record
+#   data:       PNG file contents
+#   digest:     content hash
+#   width:      image width
+#   height:     image height
+#   pixels:     decoded RGB pixels (None without Pillow)
+FrameImage = namedtuple('FrameImage', ['data', 'digest', 'width', 'height', 'pixels'])
+
+# embedded image record (sprite sheet entry)
+#   id:         image id
+#   x, y:       position in frame image
+#   width:      image width
+#   height:     image height
+#   data:       base64-encoded PNG
+Sprite = namedtuple('Sprite', ['id', 'x', 'y', 'width', 'height', 'data'])
+
+# frame record
+#   defs:       new sprites to be defined
+#   uses:       ids of the sprites composing the frame image
+#   transform:  transformation of the frame image into the frame area
+Frame = namedtuple('Frame', ['defs', 'uses', 'transform'])
+
+
+def load(path):
+    """Read, hash and decode a frame image"""
+    with open(path, "rb") as f:
+        data = f.read()
+    width, height = struct.unpack('>II', data[16:24])  # IHDR chunk
+    pixels = np.asarray(Image.open(BytesIO(data)).convert('RGB')) if Image and args.tile_area > 0 else None
+    return FrameImage(data, hashlib.sha1(data).digest(), width, height, pixels)
+
+def encode(img):
+    """Base64-encode a PNG image (or a decoded image)"""
+    if isinstance(img, bytes):
+        return str(b64encode(img), 'ascii')
+    buf = BytesIO()
+    Image.fromarray(img).save(buf, format='PNG')
+    return str(b64encode(buf.getvalue()), 'ascii')
+
+def pack(images, width=320, height=212, top=38):
+    """Deduplicate frame images and store near-identical frames as diff tiles over a key frame"""
+    seen = {}  # digest -> sprite ids
+    key = None  # current key frame (sprite id, pixels)
+    nsprites = 0
+    for img in images:
+        # fit image into frame area (like the default preserveAspectRatio)
+        scale = min(width/img.width, height/img.height)
+        transform = f"translate({(width-scale*img.width)/2},{top+(height-scale*img.height)/2}) scale({scale})"
+        defs = []
+        if img.digest in seen:
+            uses = seen[img.digest]
+        else:
+            diff = None
+            if img.pixels is not None and key is not None and key[1].shape == img.pixels.shape:
+                diff = np.any(img.pixels != key[1], axis=2)
+                rows = np.flatnonzero(diff.any(axis=1))
+                cols = np.flatnonzero(diff.any(axis=0))
+            if diff is not None and len(rows)*len(cols) <= args.tile_area*diff.size:
+                if len(rows) > 0:
+                    y0, y1, x0, x1 = rows[0], rows[-1]+1, cols[0], cols[-1]+1
+                    defs.append(Sprite(nsprites, x0, y0, x1-x0, y1-y0, encode(np.ascontiguousarray(img.pixels[y0:y1, x0:x1]))))
+                    uses = [key[0], nsprites]
+                    nsprites += 1
+                else:
+                    uses = [key[0]]
+            else:
+                defs.append(Sprite(nsprites, 0, 0, img.width, img.height, encode(img.data)))
+                uses = [nsprites]
+                key = (nsprites, img.pixels)
+                nsprites += 1
+            seen[img.digest] = uses
+        yield Frame(defs, uses, transform)
+
+def imap(executor, fn, iterable, window):
+    """Lazy, ordered map over an executor with at most `window` pending results"""
+    pending = deque()
+    for x in iterable:
+        pending.append(executor.submit(fn, x))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
 # create output directory
 Path('pages/plots').mkdir(parents=True, exist_ok=True)
 
 # load states
-states = [s for s in islice(parse_dump(args.romname, args.runid), args.offset, None)]
+states = parse_dump(args.romname, args.runid)[args.offset:]
 print(f"number of states: {len(states)}")
 
-# load frames
-frames = [str(b64encode(open(f, "rb").read()), 'ascii') for f in islice(sorted(glob(f"data/{args.romname}_dbg_{args.runid}_*.png")), args.offset, None)]
-print(f"number of frames: {len(frames)}")
+# frame images
+files = list(islice(sorted(glob(f"data/{args.romname}_dbg_{args.runid}_*.png")), args.offset, None))
+print(f"number of frames: {len(files)}")
+
+if Image is None and args.tile_area > 0:
+    print("Pillow not available: only deduplicating identical frames.")
 
-# create interactive svg
+# create interactive svg (frames are loaded in parallel while the svg is written)
 env = jinja2.Environment(loader=jinja2.FileSystemLoader('templates'))
 template = env.get_template('race.svg.j2')
-template.stream(states=states, frames=frames).dump(f"pages/plots/race_{args.runid}.svg")
+with ThreadPoolExecutor(max_workers=args.workers) as executor:
+    frames = pack(imap(executor, load, files, 2*args.workers))
+    template.stream(states=states, frames=zip(states, frames)).dump(f"pages/plots/race_{args.runid}.svg")
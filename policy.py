@@ -0,0 +1,34 @@
+"""
+Bit-packed storage of Dragster input policies.
+
+A policy assigns an input code a = 2*th + cl (see `trans.inputs`) to every
+state and time step. Codes take 2 bits, so four states are packed into one
+byte (state i is stored in bits 2*(i%4)..2*(i%4)+1 of byte i//4).
+"""
+
+import numpy as np
+
+
+def rowsize(m):
+    """Number of bytes per packed policy row for a state space of size m"""
+    return (m+3)//4
+
+def alloc(nrows, m, path=None):
+    """Allocate a packed policy array (memory-mapped to a .npy file if path is given)"""
+    if path is None:
+        return np.zeros((nrows, rowsize(m)), dtype=np.uint8)
+    return np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(nrows, rowsize(m)))
+
+def pack(codes, out=None):
+    """Pack an array of input codes into a policy row"""
+    if out is None:
+        out = np.empty(rowsize(len(codes)), dtype=np.uint8)
+    c = np.zeros(4*len(out), dtype=np.uint8)
+    c[:len(codes)] = codes
+    c = c.reshape(-1, 4)
+    np.bitwise_or(c[:, 0] | (c[:, 1] << 2), (c[:, 2] << 4) | (c[:, 3] << 6), out=out)
+    return out
+
+def get(P, j, i):
+    """Input code of state i at time step j"""
+    return (int(P[j, i >> 2]) >> (2*(i & 0x03))) & 0x03
@@ -1,5 +1,14 @@
 
+import gzip
+import mmap
+import os
+import re
+
+from array import array
 from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
 
 
 # FrameState record
@@ -18,6 +27,80 @@ from collections import namedtuple
 FrameState = namedtuple('FrameState', ['frame', 'status', 'countdown', 'time', 'x', 'v', 'y', 'r', 'vr', 'th', 'cl', 'rs'])
 
 
+
+class Trace:
+    """Columnar sequence of frame states.
+
+    The FrameState fields are stored as rows of one (fields x frames) int32
+    array. Columns are available as attributes (e.g. `trace.x`), integer
+    indexing and iteration produce FrameState records and slicing returns a
+    Trace view of the same data.
+    """
+
+    def __init__(self, data):
+        data = np.asarray(data, dtype=np.int32)
+        if data.ndim != 2 or data.shape[0] != len(FrameState._fields):
+            raise ValueError(f"Invalid trace data shape: {data.shape}.")
+        self.data = data
+
+    @classmethod
+    def from_states(cls, states):
+        """Create a trace from an iterable of FrameState records."""
+        buf = array('i')
+        for s in states:
+            buf.extend(s)
+        return cls(np.frombuffer(buf, dtype=np.int32).reshape(-1, len(FrameState._fields)).T)
+
+    @classmethod
+    def from_numpy(cls, columns):
+        """Create a trace from a dict of column arrays or a (fields x frames) array.
+
+        The columns of a dict are copied into a new (fields x frames) array, an
+        int32 array is used as is (without copying).
+        """
+        if isinstance(columns, dict):
+            data = np.empty((len(FrameState._fields), len(columns[FrameState._fields[0]])), dtype=np.int32)
+            for row, f in zip(data, FrameState._fields):
+                row[:] = columns[f]
+            columns = data
+        return cls(columns)
+
+    def to_numpy(self):
+        """Dict of column arrays (views of the trace data)."""
+        return dict(zip(FrameState._fields, self.data))
+
+    def concat(self, other):
+        """Concatenate two traces."""
+        return Trace(np.concatenate((self.data, other.data), axis=1))
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def __getattr__(self, name):
+        try:
+            i = FrameState._fields.index(name)
+        except ValueError:
+            raise AttributeError(name) from None
+        return self.data[i]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Trace(self.data[:, key])
+        return FrameState._make(self.data[:, key].tolist())
+
+    def __iter__(self):
+        for k in range(0, len(self), 1024):
+            yield from map(FrameState._make, self.data[:, k:k+1024].T.tolist())
+
+    def __eq__(self, other):
+        if not isinstance(other, Trace):
+            return NotImplemented
+        return np.array_equal(self.data, other.data)
+
+    def __repr__(self):
+        return f"Trace(frames={len(self)})"
+
+
 def gearchr(y, cl):
     if cl == 1: return 'C'
     elif y == 0: return 'N'
@@ -46,47 +129,76 @@ def vref(y, r):
     return ((1 << y) >> 1)*r + ((1 << y) >> 2)*(r >= 20)
 
 
-def sim(ingen, offset=0, verbose=0):
-    """Simulate the game state."""
+# SimState record (internal simulator state at the beginning of a main loop iteration)
+#   t:         frame counter
+#   tm:        countdown
+#   tr:        race time
+#   x:         distance
+#   v:         speed
+#   y:         gear
+#   r:         motor r.p.m.
+#   vr:        reference speed
+#   th:        throttle (of frame t)
+#   cl:        clutch (of frame t)
+#   thprev:    throttle (of last odd frame)
+#   clprev:    clutch (of last odd frame)
+#   busted:    busted flag
+SimState = namedtuple('SimState', ['t', 'tm', 'tr', 'x', 'v', 'y', 'r', 'vr', 'th', 'cl', 'thprev', 'clprev', 'busted'])
+
+
+def sim(ingen, offset=0, verbose=0, resume=None, snapshot=None):
+    """Simulate the game state.
+
+    If `resume` is a SimState, the simulation restarts from that state (with
+    `ingen` yielding the inputs for frames resume.t+1, ...). If `snapshot` is
+    given, it is called with the current SimState at the beginning of every
+    main loop iteration (i.e. right before the state of frame t is yielded).
+    """
 
     # TODO: also support odd start frames
     if (offset & 0x01) != 0:
         ValueError(f"Odd numbered start frames are not supported: offset = {offset}.")
 
-    # time
-    t = 0
-    tm = 0  # countdown
-    tr = 1111000  # race time (invalid BCD value)
+    if resume is not None:
+        t, tm, tr, x, v, y, r, vr, th, cl, thprev, clprev, busted = resume
+    else:
+        # time
+        t = 0
+        tm = 0  # countdown
+        tr = 1111000  # race time (invalid BCD value)
 
-    # initial conditions
-    x = 0  # distance
-    v = 0  # speed
-    y = 0  # gear
-    r = 0  # motor rpm
-    vr = 0 # reference speed
+        # initial conditions
+        x = 0  # distance
+        v = 0  # speed
+        y = 0  # gear
+        r = 0  # motor rpm
+        vr = 0 # reference speed
 
-    busted = False
+        busted = False
 
-    # inputs
-    th = thprev = 0
-    cl = clprev = 0
+        # inputs
+        th = thprev = 0
+        cl = clprev = 0
 
-    # start game (hard-coded)
-    yield FrameState(frame=t, status=0x0100, countdown=tm, time=tr, x=x, v=v, y=1, r=r, vr=vr, th=0, cl=0, rs=0)
-    for s in range(offset):
+        # start game (hard-coded)
+        yield FrameState(frame=t, status=0x0100, countdown=tm, time=tr, x=x, v=v, y=1, r=r, vr=vr, th=0, cl=0, rs=0)
+        for s in range(offset):
+            t += 1
+            th, cl = next(ingen)
+            yield FrameState(frame=t, status=0x0100, countdown=tm, time=tr, x=x, v=v, y=1, r=r, vr=vr, th=th, cl=cl, rs=0)
         t += 1
+        tm = 159
+        th, cl = next(ingen)
+        yield FrameState(frame=t, status=0, countdown=tm, time=tr, x=x, v=v, y=y, r=r, vr=vr, th=th, cl=cl, rs=1)
+        t += 1
+        tm = max(tm-1, 0)
         th, cl = next(ingen)
-        yield FrameState(frame=t, status=0x0100, countdown=tm, time=tr, x=x, v=v, y=1, r=r, vr=vr, th=th, cl=cl, rs=0)
-    t += 1
-    tm = 159
-    th, cl = next(ingen)
-    yield FrameState(frame=t, status=0, countdown=tm, time=tr, x=x, v=v, y=y, r=r, vr=vr, th=th, cl=cl, rs=1)
-    t += 1
-    tm = max(tm-1, 0)
-    th, cl = next(ingen)
 
     # main loop
     while True:
+        # save simulator state
+        if snapshot is not None:
+            snapshot(SimState(t=t, tm=tm, tr=tr, x=x, v=v, y=y, r=r, vr=vr, th=th, cl=cl, thprev=thprev, clprev=clprev, busted=busted))
         # check end conditions
         if tm > 0 and y > 0:
             if verbose > 0:
@@ -186,16 +298,198 @@ def sim(ingen, offset=0, verbose=0):
         # ***ENDEBUG***
 
 
-def write_script(script, ingen, offset=0, maxframe=None):
-    """Write a Stella debug script for the given user inputs."""
+# lane termination reasons of batch simulations
+RUNNING = 0   # inputs exhausted
+FINISHED = 1
+BUSTED = 2
+TIMEUP = 3
+EARLY = 4     # gear engaged during countdown
+
+# BatchResult record
+#   frame:     final frame counter (per lane)
+#   status:    final game/player status (per lane)
+#   end:       termination reason (per lane)
+#   x:         final distance (per lane)
+#   v:         final speed (per lane)
+#   traces:    dict of (lanes x frames) arrays for all FrameState fields (or None)
+BatchResult = namedtuple('BatchResult', ['frame', 'status', 'end', 'x', 'v', 'traces'])
+
+
+def sim_batch(inputs, offset=0, traces=False):
+    """Simulate the game state for many input sequences in lockstep.
+
+    The inputs are given as an array of shape (lanes, frames, 2) holding the
+    (throttle, clutch) values for frames 1, 2, ... (i.e. the values yielded
+    by the input generators of sim()). The final state of each lane is the
+    last state yielded by sim() for the same inputs.
+    """
+
+    inputs = np.asarray(inputs, dtype=np.int32)
+    nlanes, nframes = inputs.shape[:2]
+    if nframes < offset+2:
+        raise ValueError(f"Inputs of {nframes} frames end before the race starts (at least {offset+2} frames are required for offset {offset}).")
+
+    # last yielded state per lane (and full traces)
+    final = {f: np.zeros(nlanes, dtype=np.int32) for f in FrameState._fields}
+    trace = {f: np.full((nlanes, nframes+1), -1, dtype=np.int32) for f in FrameState._fields} if traces else None
+    end = np.full(nlanes, RUNNING, dtype=np.int32)
+
+    def emit(mask, t, **fields):
+        for f, val in fields.items():
+            np.copyto(final[f], val, where=mask)
+            if traces:
+                np.copyto(trace[f][:, t], val, where=mask)
+
+    # time
+    t = 0
+    tm = 0  # countdown
+    tr = 1111000  # race time (invalid BCD value)
+
+    # initial conditions
+    x = np.zeros(nlanes, dtype=np.int32)  # distance
+    v = np.zeros(nlanes, dtype=np.int32)  # speed
+    y = np.zeros(nlanes, dtype=np.int32)  # gear
+    r = np.zeros(nlanes, dtype=np.int32)  # motor rpm
+    vr = np.zeros(nlanes, dtype=np.int32) # reference speed
+
+    active = np.ones(nlanes, dtype=bool)
+
+    # inputs
+    thprev = np.zeros(nlanes, dtype=np.int32)
+    clprev = np.zeros(nlanes, dtype=np.int32)
+
+    rpm_skip = np.array([0x00, 0x00, 0x02, 0x06, 0x0E])
+    rpm_incr = np.array([0x03, 0x01, 0x01, 0x01, 0x01])
+
+    # start game (hard-coded)
+    emit(active, t, frame=t, status=0x0100, countdown=tm, time=tr, x=x, v=v, y=1, r=r, vr=vr, th=0, cl=0, rs=0)
+    for s in range(offset):
+        t += 1
+        th, cl = inputs[:, t-1, 0], inputs[:, t-1, 1]
+        emit(active, t, frame=t, status=0x0100, countdown=tm, time=tr, x=x, v=v, y=1, r=r, vr=vr, th=th, cl=cl, rs=0)
+    t += 1
+    tm = 159
+    th, cl = inputs[:, t-1, 0], inputs[:, t-1, 1]
+    emit(active, t, frame=t, status=0, countdown=tm, time=tr, x=x, v=v, y=y, r=r, vr=vr, th=th, cl=cl, rs=1)
+    t += 1
+    tm = max(tm-1, 0)
+    th, cl = inputs[:, t-1, 0], inputs[:, t-1, 1]
+
+    # main loop
+    while active.any():
+        # check end conditions
+        if tm > 0:
+            early = active & (y > 0)
+            end[early] = EARLY
+            active &= ~early
+        # record current state
+        emit(active, t, frame=t, status=0, countdown=tm, time=tr, x=x, v=v, y=y, r=r, vr=vr, th=th, cl=cl, rs=0)
+        # update timer
+        t += 1
+        tm = max(tm-1, 0)
+        tr = tr if tm > 0 else 334*(t & 0x01) if tr == 1111000 else tr+334 if t & 0x01 == 1 else tr
+        # check for max time
+        if tm == 0 and tr > 999999:
+            emit(active, t, frame=t, status=0x0100, countdown=tm, time=999900, x=x, v=v, y=y, r=0, vr=0, th=th, cl=cl, rs=0)
+            end[active] = TIMEUP
+            break
+        if t > nframes:
+            break  # inputs exhausted
+        # current inputs
+        th, cl = inputs[:, t-1, 0], inputs[:, t-1, 1]
+        # do state updates in odd frames only
+        if t & 0x01 == 1:
+            # update distance
+            x += v
+            # check for finish line
+            finished = active & (x >= 24832)
+            emit(finished, t, frame=t, status=0x0100, countdown=tm, time=tr, x=x, v=v, y=y, r=0, vr=0, th=th, cl=cl, rs=0)
+            end[finished] = FINISHED
+            active &= ~finished
+            # update motor RPM
+            yidx = (1-clprev)*y
+            r = np.where(t & rpm_skip[yidx] == 0, np.maximum(r + (2*th-1)*rpm_incr[yidx], 0), r)
+            # check for 'busted'
+            busted = r >= 32
+            r[busted] = 0
+            # update speed
+            drive = (y > 0) & (clprev == 0)
+            vr = np.where(drive, vref(y, r), vr)
+            vinc = drive & (vr > v)
+            r -= vinc & (vr-v >= 16)
+            v += 2*vinc - (drive & (vr < v))
+            busted &= active
+            emit(busted, t, frame=t, status=0x0001, countdown=tm, time=tr, x=x, v=v, y=y, r=0, vr=vr, th=th, cl=cl, rs=0)
+            end[busted] = BUSTED
+            active &= ~busted
+            # update gear
+            y = np.where((cl == 0) & (clprev == 1), np.minimum(y+1, 4), y)
+            # save input values
+            thprev = th
+            clprev = cl
+
+    if traces:
+        trace = {f: a[:, :final['frame'].max()+1] for f, a in trace.items()}
+    return BatchResult(frame=final['frame'], status=final['status'], end=end, x=final['x'], v=final['v'], traces=trace)
+
+
+# write_script capture policies (frames saved with 'savesnap' and 'dump')
+#   all:       every frame
+#   window:A:B frames A..B (inclusive)
+#   every:N    every N-th frame
+#   changes:   frames with input changes
+#   final:     last frame
+# policies can be combined with '+', e.g. 'changes+final'
+def capture_policy(spec):
+    """Parse a capture policy specification into a predicate capture(s, changed, last)."""
+
+    preds = []
+    for p in spec.split('+'):
+        name, *params = p.split(':')
+        try:
+            if name == 'all' and not params:
+                preds.append(lambda s, changed, last: True)
+            elif name == 'window' and len(params) == 2:
+                first, last_ = int(params[0]), int(params[1])
+                preds.append(lambda s, changed, last: first <= s.frame <= last_)
+            elif name == 'every' and len(params) == 1 and int(params[0]) > 0:
+                n = int(params[0])
+                preds.append(lambda s, changed, last: s.frame % n == 0)
+            elif name == 'changes' and not params:
+                preds.append(lambda s, changed, last: changed)
+            elif name == 'final' and not params:
+                preds.append(lambda s, changed, last: last)
+            else:
+                raise ValueError()
+        except ValueError:
+            raise ValueError(f"Invalid capture policy: '{p}'.") from None
+    return lambda s, changed, last: any(pred(s, changed, last) for pred in preds)
+
+
+def write_script(script, ingen, offset=0, maxframe=None, capture='all', snapshots=True):
+    """Write a Stella debug script for the given user inputs.
+
+    Screenshots ('savesnap', unless `snapshots` is false) and RAM dumps are
+    only written for frames selected by the capture policy (see
+    `capture_policy`). Returns the list of captured frame numbers.
+    """
+
+    if isinstance(capture, str):
+        capture = capture_policy(capture)
 
     # previous inputs
     thprev = 0
     clprev = 0
     rsprev = 0
 
-    for s in sim(ingen, offset):
+    frames = []
+    states = sim(ingen, offset)
+    s = next(states)
+    while s is not None:
+        # look ahead to detect the last frame
+        snext = None if maxframe and s.frame >= maxframe else next(states, None)
         # inputs
+        changed = (s.th, s.cl, s.rs) != (thprev, clprev, rsprev)
         if s.th != thprev:
             script.write("joy0fire\n")
         if s.cl != clprev:
@@ -204,49 +498,216 @@ def write_script(script, ingen, offset=0, maxframe=None):
             script.write("joy0right\n")
         # update game logic
         script.write("stepwhile pc!=$f29a\n")
-        script.write("savesnap\n")
-        script.write("dump 80 ff 7\n")
-        if maxframe and s.frame >= maxframe:
-            break
+        if capture(s, changed, snext is None):
+            if snapshots:
+                script.write("savesnap\n")
+            script.write("dump 80 ff 7\n")
+            frames.append(s.frame)
         # save input values
         thprev = s.th
         clprev = s.cl
         rsprev = s.rs
+        s = snext
+    return frames
+
+
+def write_scripts(path, gen, offsets, maxframe=None, capture='all', snapshots=True):
+    """Write Stella debug scripts for several start frame offsets.
+
+    `path` is a format string with an 'offset' field and `gen(offset)` returns
+    the input generator for an offset. Returns a dict of captured frame
+    numbers per offset.
+    """
+
+    capture = capture_policy(capture) if isinstance(capture, str) else capture
+    frames = {}
+    for offset in offsets:
+        with open(path.format(offset=offset), "w") as script:
+            frames[offset] = write_script(script, gen(offset), offset, maxframe, capture, snapshots)
+    return frames
+
+
+def read_script(script):
+    """Read the inputs and captured frames of a Stella debug script (see `write_script`).
+
+    Returns an array of (th, cl, rs) values per frame and the list of captured
+    frame numbers.
+    """
+
+    toggles = {'joy0fire': 0, 'joy0left': 1, 'joy0right': 2}
+    u = [0, 0, 0]
+    inputs = []
+    frames = []
+    for line in script:
+        cmd = line.split(maxsplit=1)[0] if line.strip() else None
+        if cmd in toggles:
+            u[toggles[cmd]] = 1 - u[toggles[cmd]]
+        elif cmd == 'stepwhile':
+            inputs.append(tuple(u))
+        elif cmd == 'dump':
+            frames.append(len(inputs)-1)
+    return np.array(inputs, dtype=np.int32).reshape(-1, 3), frames
+
+
+# dump file layout ('dump 80 ff 7'): 10 lines per frame
+#   lines 0-7:  RAM $80-$FF, e.g. "80: 00 01 02 03 04 05 06 07 - 08 09 0a 0b 0c 0d 0e 0f"
+#   lines 8-9:  CPU and input (SWCHA, INPTx) registers
+DUMP_LINES = 10
+DUMP_RAM_COLS = [1, 2, 3, 4, 5, 6, 7, 8, 10, 11, 12, 13, 14, 15, 16, 17]
+DUMP_IO_TOKENS = [(9, 1), (9, 14)]  # SWCHA, INPT4
+
+
+def dump_path(romname, runid, datadir='data'):
+    """Path of a (possibly gzip/zstd compressed) Stella dump file."""
+    path = Path(datadir) / f"{romname}_dbg_{runid}.dump"
+    for p in (path, path.with_name(path.name + '.gz'), path.with_name(path.name + '.zst')):
+        if p.exists():
+            return p
+    return path
+
+
+def read_dump(path):
+    """Read a Stella dump file into arrays of RAM ($80-$FF) and input register snapshots."""
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return np.zeros((0, 128), dtype=np.uint8), np.zeros((0, len(DUMP_IO_TOKENS)), dtype=np.uint8)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:2] == b'\x1f\x8b':
+                buf = gzip.decompress(mm)
+            elif mm[:4] == b'\x28\xb5\x2f\xfd':
+                try:
+                    import zstandard
+                except ImportError:
+                    raise RuntimeError(f"Reading zstd compressed dump '{path}' requires the 'zstandard' package.") from None
+                buf = zstandard.ZstdDecompressor().stream_reader(mm).read()
+            else:
+                buf = mm
+            # determine token layout from first frame
+            lines = buf[:0x10000].split(b'\n')[:DUMP_LINES]
+            tokens = [l.split() for l in lines]
+            if len(lines) < DUMP_LINES or any(len(t) != 18 or t[9] != b'-' for t in tokens[:8]):
+                raise ValueError(f"Unsupported dump file format: '{path}'.")
+            # byte offsets of the used tokens within their lines
+            starts = [[t.start() for t in re.finditer(rb'\S+', l)] for l in lines]
+            fields = [(row, starts[row][col]) for row in range(8) for col in DUMP_RAM_COLS] + \
+                     [(row, starts[row][col]) for row, col in DUMP_IO_TOKENS]
+            # decode all frames in one pass (token by token if the line layout varies)
+            data, error = decode_dump(np.frombuffer(buf, dtype=np.uint8), [len(l) for l in lines], fields)
+            if data is None and error is None:
+                data, error = decode_dump_tokens(buf)
+            del buf
+    if data is None:
+        raise ValueError(f"{error}: '{path}'.")
+    return data[:, :128], data[:, 128:]
+
+
+# hex digit values (-1 for non-hex characters)
+HEX_DIGITS = np.full(256, -1, dtype=np.int16)
+HEX_DIGITS[np.frombuffer(b'0123456789abcdef', dtype=np.uint8)] = np.arange(16)
+HEX_DIGITS[np.frombuffer(b'ABCDEF', dtype=np.uint8)] = np.arange(10, 16)
+
+
+def decode_dump(buf, linelens, fields):
+    """Decode the hex bytes at the given (line, byte offset) fields of every frame of a dump buffer.
+
+    Returns the (frames, fields) uint8 array and None, or None and an error
+    message. If the line lengths differ from those of the first frame (e.g.
+    other whitespace), None and None are returned (see `decode_dump_tokens`).
+    """
+
+    n = len(buf)
+    while n > 0 and buf[n-1] in b' \t\r\n':  # ignore trailing whitespace
+        n -= 1
+    ends = np.flatnonzero(buf[:n] == ord('\n'))
+    ends = np.append(ends, n)
+    if len(ends) % DUMP_LINES != 0:
+        return None, "Truncated dump file"
+    starts = np.concatenate(([0], ends[:-1]+1)).reshape(-1, DUMP_LINES)
+    if (ends.reshape(-1, DUMP_LINES) - starts != linelens).any():
+        return None, None
+    pos = starts[:, [row for row, _ in fields]] + np.array([col for _, col in fields])
+    hi, lo = HEX_DIGITS[buf[pos]], HEX_DIGITS[buf[pos+1]]
+    if (hi < 0).any() or (lo < 0).any():
+        return None, "Invalid hex value in dump file"
+    return (16*hi + lo).astype(np.uint8), None
+
+
+def decode_dump_tokens(buf):
+    """Decode the RAM and input register tokens of every frame of a dump buffer (line by line).
+
+    Returns the (frames, fields) uint8 array and None, or None and an error message.
+    """
+
+    lines = bytes(buf).rstrip().split(b'\n')
+    if len(lines) % DUMP_LINES != 0:
+        return None, "Truncated dump file"
+    cols = [(row, col) for row in range(8) for col in DUMP_RAM_COLS] + DUMP_IO_TOKENS
+    data = np.zeros((len(lines)//DUMP_LINES, len(cols)), dtype=np.uint8)
+    for k in range(len(data)):
+        tokens = [l.split() for l in lines[k*DUMP_LINES:(k+1)*DUMP_LINES]]
+        try:
+            data[k] = np.frombuffer(bytes.fromhex(b' '.join(tokens[row][col] for row, col in cols).decode()), dtype=np.uint8)
+        except (IndexError, ValueError):
+            return None, f"Invalid dump file format (frame {k})"
+    return data, None
+
+
+def load_dump(romname, runid, cache=True, datadir='data'):
+    """Load RAM and input register snapshots of a Stella dump file (using a binary sidecar cache)."""
+
+    path = dump_path(romname, runid, datadir)
+    stat = path.stat()
+    cpath = path.with_name(path.name + '.npz')
+    if cache and cpath.exists():
+        with np.load(cpath) as c:
+            if c['size'] == stat.st_size and c['mtime'] == stat.st_mtime_ns:
+                return c['ram'], c['io']
+    ram, io = read_dump(path)
+    if cache:
+        np.savez(cpath, ram=ram, io=io, size=stat.st_size, mtime=stat.st_mtime_ns)
+    return ram, io
 
 
 # parse dump file
-def parse_dump(romname, runid):
-    """Parse a Stella dump file."""
-
-    with open(f"data/{romname}_dbg_{runid}.dump", 'r') as f:
-        fmsb = -1
-        while True:
-            data = [f.readline().split() for _ in range(10)]
-            if len(data[0]) == 0:
-                break
-            # print(data)
-            fidx = int(data[0][2], 16)
-            if fidx == 0 or fmsb < 0:
-                fmsb += 1
-            yield FrameState(
-                frame = (fmsb << 8) + fidx,
-                status = (int(data[5][3], 16) << 8) + int(data[5][5], 16),  # $D2, $D4
-                countdown = int(data[0][15], 16),
-                time = 100000*(int(data[3][4], 16) >> 4)   +  \
-                        10000*(int(data[3][4], 16) & 0x0F) +  \
-                         1000*(int(data[3][6], 16) >> 4)   +  \
-                          100*(int(data[3][6], 16) & 0x0F) +  \
-                           10*(int(data[3][8], 16) >> 4)   +  \
-                            1*(int(data[3][8], 16) & 0x0F),
-                x = (int(data[3][12], 16) << 8) + int(data[4][3], 16),
-                v = int(data[4][1], 16),
-                y = int(data[4][14], 16) & 0x7F,
-                r = int(data[2][10], 16),
-                vr = 0, # FIXME: read out reference speed
-                th = 1 - ((int(data[9][14], 16) & 0x80) >> 7),
-                cl = 1 - ((int(data[9][1],  16) & 0x40) >> 6),  # 1 - ((int(data[2][15], 16) & 0x04) >> 2),
-                rs = 1 - ((int(data[9][1],  16) & 0x80) >> 7)   # 1 - ((int(data[2][15], 16) & 0x08) >> 3)
-            )
+def parse_dump(romname, runid, cache=True, frames=None, datadir='data'):
+    """Parse a Stella dump file.
+
+    The frame numbers are reconstructed from the frame counter ($81), which
+    requires less than 256 frames between captured frames. Otherwise, the
+    captured frame numbers (as returned by `write_script`) must be given.
+    """
+
+    ram, io = load_dump(romname, runid, cache, datadir)
+    ram = ram.astype(np.int32)
+    io = io.astype(np.int32)
+    if frames is not None:
+        if len(frames) != len(ram):
+            raise ValueError(f"Number of frames ({len(frames)}) does not match dump ({len(ram)}).")
+        frame = np.asarray(frames, dtype=np.int32)
+    else:
+        # frame counter ($81) with MSB incremented on every wrap-around
+        fidx = ram[:, 0x01]
+        fmsb = np.cumsum(np.concatenate(([True], fidx[1:] <= fidx[:-1]))) - 1
+        frame = (fmsb << 8) + fidx
+    # race time (BCD)
+    time = np.zeros(len(ram), dtype=np.int32)
+    for a in (0x33, 0x35, 0x37):
+        time = 100*time + 10*(ram[:, a] >> 4) + (ram[:, a] & 0x0F)
+    return Trace.from_numpy(dict(
+        frame = frame,
+        status = (ram[:, 0x52] << 8) + ram[:, 0x54],  # $D2, $D4
+        countdown = ram[:, 0x0D],
+        time = time,
+        x = (ram[:, 0x3A] << 8) + ram[:, 0x42],
+        v = ram[:, 0x40],
+        y = ram[:, 0x4C] & 0x7F,
+        r = ram[:, 0x28],
+        vr = np.zeros(len(ram), dtype=np.int32), # FIXME: read out reference speed
+        th = 1 - ((io[:, 1] & 0x80) >> 7),
+        cl = 1 - ((io[:, 0] & 0x40) >> 6),  # 1 - ((ram[:, 0x2D] & 0x04) >> 2),
+        rs = 1 - ((io[:, 0] & 0x80) >> 7)   # 1 - ((ram[:, 0x2D] & 0x08) >> 3)
+    ))
 
 
 if __name__ == "__main__":
@@ -260,8 +721,15 @@ if __name__ == "__main__":
     parser.add_argument("runid", help="The identifier of the run.")
     parser.add_argument("--romname", default="Dragster (1980) (Activision)", help="The name of the ROM file.")
     parser.add_argument("--offset", type=int, default=0, help="Start frame offset (0-15).")
+    parser.add_argument("--all-offsets", action="store_true", help="Write scripts '<runid>_ofs0' .. '<runid>_ofsE' for all (even) offsets.")
+    parser.add_argument("--capture", default="all", help="Capture policy: all, window:A:B, every:N, changes, final (combined with '+').")
+    parser.add_argument("--no-snapshots", action="store_true", help="Only dump RAM (no screenshots).")
     parser.add_argument("--check-dump", action="store_true", help="Check simulation with Stella dump.")
     args = parser.parse_args()
+    try:
+        capture = capture_policy(args.capture)
+    except ValueError as e:
+        parser.error(str(e))
 
     # demo input generator
     def demogen(offset):
@@ -280,30 +748,39 @@ if __name__ == "__main__":
             yield th, cl
             t += 1
 
-    # write Stella debug script
+    # write Stella debug scripts
     Path('scripts').mkdir(parents=True, exist_ok=True)  # create 'scripts' directory
-    with open(f"scripts/{args.runid}.script", "w") as script:
-        write_script(script, demogen(args.offset), args.offset)
+    if args.all_offsets:
+        offsets = range(0, 16, 2)
+        runid = f"{args.runid}_ofs{{offset:X}}"
+    else:
+        offsets = [args.offset]
+        runid = args.runid
+    captured = write_scripts(f"scripts/{runid}.script", demogen, offsets, capture=capture, snapshots=not args.no_snapshots)
 
     if args.check_dump:
-        # compare dump with simulation
-        ndiffs = 0
-        for ss, sd in zip(sim(demogen(args.offset), args.offset), parse_dump(args.romname, args.runid)):
-            if (ss.status != sd.status) or (ss.time != sd.time) or (ss.countdown != sd.countdown) or \
-               (ss.x != sd.x) or (ss.v != sd.v) or (ss.y != sd.y) or (ss.r != sd.r) or (ss.th != sd.th):
-                ndiffs += 1
-                print(f"frame     {ss.frame:8d}  --  frame     {sd.frame:8d}")
-                print(f"status    {ss.status:8d}  --  status    {sd.status:8d}")
-                print(f"countdown {ss.countdown:8d}  --  countdown {sd.countdown:8d}")
-                print(f"time      {ss.time:8d}  --  time      {sd.time:8d}")
-                print(f"x         {ss.x:8d}  --  x         {sd.x:8d}")
-                print(f"v         {ss.v:8d}  --  v         {sd.v:8d}")
-                print(f"y         {ss.y:8d}  --  y         {sd.y:8d}")
-                print(f"r         {ss.r:8d}  --  r         {sd.r:8d}")
-                print(f"vr        {ss.vr:8d}  --  vr        {sd.vr:8d}")
-                print(f"th        {ss.th:8d}  --  th        {sd.th:8d}")
-                print(f"cl        {ss.cl:8d}  --  cl        {sd.cl:8d}")
-                print(f"rs        {ss.rs:8d}  --  rs        {sd.rs:8d}")
-                print()
-        if ndiffs == 0:
-            print('Frame states are equal.')
\ No newline at end of file
+        for offset in offsets:
+            # compare dump with simulation (at captured frames)
+            frames = captured[offset]
+            states = (ss for ss in sim(demogen(offset), offset) if ss.frame in set(frames))
+            dump = parse_dump(args.romname, runid.format(offset=offset), frames=None if args.capture == 'all' else frames)
+            ndiffs = 0
+            for ss, sd in zip(states, dump):
+                if (ss.status != sd.status) or (ss.time != sd.time) or (ss.countdown != sd.countdown) or \
+                   (ss.x != sd.x) or (ss.v != sd.v) or (ss.y != sd.y) or (ss.r != sd.r) or (ss.th != sd.th):
+                    ndiffs += 1
+                    print(f"frame     {ss.frame:8d}  --  frame     {sd.frame:8d}")
+                    print(f"status    {ss.status:8d}  --  status    {sd.status:8d}")
+                    print(f"countdown {ss.countdown:8d}  --  countdown {sd.countdown:8d}")
+                    print(f"time      {ss.time:8d}  --  time      {sd.time:8d}")
+                    print(f"x         {ss.x:8d}  --  x         {sd.x:8d}")
+                    print(f"v         {ss.v:8d}  --  v         {sd.v:8d}")
+                    print(f"y         {ss.y:8d}  --  y         {sd.y:8d}")
+                    print(f"r         {ss.r:8d}  --  r         {sd.r:8d}")
+                    print(f"vr        {ss.vr:8d}  --  vr        {sd.vr:8d}")
+                    print(f"th        {ss.th:8d}  --  th        {sd.th:8d}")
+                    print(f"cl        {ss.cl:8d}  --  cl        {sd.cl:8d}")
+                    print(f"rs        {ss.rs:8d}  --  rs        {sd.rs:8d}")
+                    print()
+            if ndiffs == 0:
+                print('Frame states are equal.')
\ No newline at end of file
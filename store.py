@@ -0,0 +1,117 @@
+"""
+Content-addressed store of solver results.
+
+A result (optimal input codes, objective and per-step states) is stored in a
+`.npz` file named after the SHA-256 hash of the solver name, its parameters
+and the physics code (the transition functions of `trans.py`, the reference
+speed of `sim.py` and the motor speed masks and increments). Any change of the
+physics changes the key, so stale results are never returned.
+"""
+
+import hashlib
+import inspect
+import json
+
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+import sim
+import trans
+
+
+# Result record
+#   u:         input codes (a = 2*th + cl) of the optimal solution
+#   objective: objective value
+#   states:    dict of per-step state arrays (e.g. 'c', 'y', 'r', 'v')
+#   meta:      dict of solver name, parameters, creation date and extra info
+Result = namedtuple('Result', ['u', 'objective', 'states', 'meta'])
+
+
+def physics_hash(*code):
+    """SHA-256 hash of the physics code (and of additional source code strings)"""
+    h = hashlib.sha256()
+    for fn in (trans.nxt, trans.nxtv, sim.vref):
+        h.update(inspect.getsource(fn).encode())
+    h.update(repr((trans.rpm_skip, trans.rpm_incr)).encode())
+    for c in code:
+        h.update(c.encode())
+    return h.hexdigest()
+
+
+class ResultStore:
+    """Solver results keyed by solver, parameters and physics hash (disabled if path is None)"""
+
+    def __init__(self, path='data/results'):
+        self.path = Path(path) if path is not None else None
+
+    def key(self, solver, params, code=()):
+        """Key of a solver run (code: additional source code the result depends on)"""
+        doc = dict(solver=solver, params=params, physics=physics_hash(*code))
+        return hashlib.sha256(json.dumps(doc, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        """Stored result (None if missing or unreadable)"""
+        if self.path is None:
+            return None
+        try:
+            with np.load(self.path / f"{key}.npz") as f:
+                states = {k[len('state_'):]: f[k] for k in f.files if k.startswith('state_')}
+                return Result(f['u'], f['objective'].item(), states, json.loads(f['meta'].item()))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, u, objective, states, **meta):
+        """Store a result (atomically), meta should hold the solver name and parameters"""
+        if self.path is None:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        meta = dict(meta, created=datetime.now().isoformat(timespec='seconds'))
+        tmp = self.path / f"{key}.tmp.npz"
+        np.savez(tmp, u=np.asarray(u, dtype=np.uint8), objective=objective, meta=json.dumps(meta),
+                 **{f"state_{k}": np.asarray(s) for k, s in states.items()})
+        tmp.replace(self.path / f"{key}.npz")
+
+    def entries(self):
+        """All stored results as (key, result) pairs"""
+        if self.path is None or not self.path.exists():
+            return []
+        keys = sorted(p.name[:-len('.npz')] for p in self.path.glob('*.npz') if not p.name.endswith('.tmp.npz'))
+        entries = [(key, self.get(key)) for key in keys]
+        return [(key, res) for key, res in entries if res is not None]
+
+
+def add_arguments(parser):
+    """Add the result store command line options to an argument parser"""
+    parser.add_argument("--store", metavar="DIR", default="data/results", help="Directory of the result store.")
+    parser.add_argument("--no-store", action="store_true", help="Always solve (neither read nor write the result store).")
+
+def from_args(args):
+    """Result store for the parsed command line options"""
+    return ResultStore(None if args.no_store else args.store)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description="List (or clear) stored solver results.")
+    parser.add_argument("--store", metavar="DIR", default="data/results", help="Directory of the result store.")
+    parser.add_argument("--clear", action="store_true", help="Delete all stored results.")
+    args = parser.parse_args()
+
+    rs = ResultStore(args.store)
+    entries = rs.entries()
+    if args.clear:
+        for key, _ in entries:
+            (rs.path / f"{key}.npz").unlink()
+        print(f"Deleted {len(entries)} results.")
+    else:
+        print("key           solver  params                                  objective  created")
+        print("-------------------------------------------------------------------------------------------")
+        for key, res in entries:
+            params = ", ".join(f"{k}={v}" for k, v in res.meta['params'].items())
+            print(f"{key[:12]}  {res.meta['solver']:6s}  {params:38s}  {res.objective:9g}  {res.meta['created']}")
@@ -0,0 +1,150 @@
+"""
+Opt-in profiling and progress telemetry for long solver runs.
+
+A Telemetry object streams records as JSON lines to a file. Every record has
+the elapsed time `t` (in seconds), a `kind` ('start', 'phase', 'step',
+'stats', 'profile', 'allocations' or 'end') and the peak resident set size
+`rss` (in MB, including terminated child processes). With `tracemalloc`
+enabled, the current and peak traced Python allocations are added as well.
+The `hot` context manager runs the enclosed code (e.g. the main solver loop)
+under cProfile and records the top allocation sites afterwards.
+
+A disabled Telemetry object (no path) records nothing, so the solvers can
+call it unconditionally.
+"""
+
+import cProfile
+import json
+import pstats
+import resource
+import sys
+import tracemalloc as tm
+
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+
+
+class Telemetry:
+    """JSON lines telemetry writer (disabled if path is None)"""
+
+    def __init__(self, path=None, profile=None, tracemalloc=False, **info):
+        self.path = path
+        self.profile = profile
+        self.enabled = path is not None
+        self.tracemalloc = tracemalloc and self.enabled  # allocations are only traced for the records
+        self._file = open(path, "w") if self.enabled else None
+        self._tbeg = perf_counter()
+        self._tstep = None
+        if self.tracemalloc:
+            tm.start()
+        self.record('start', argv=sys.argv, **info)
+
+    def record(self, kind, **fields):
+        """Write a record"""
+        if not self.enabled:
+            return
+        rec = dict(t=round(perf_counter()-self._tbeg, 6), kind=kind, **fields)
+        rec['rss'] = round(max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)/1024, 1)
+        if self.tracemalloc:
+            current, peak = tm.get_traced_memory()
+            rec['traced'] = round(current/(1 << 20), 1)
+            rec['traced_peak'] = round(peak/(1 << 20), 1)
+        self._file.write(json.dumps(rec) + "\n")
+        self._file.flush()
+
+    @contextmanager
+    def phase(self, name, **fields):
+        """Record the duration of a phase (e.g. model build or solve)"""
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self.record('phase', name=name, seconds=round(perf_counter()-t0, 6), **fields)
+
+    def step(self, j, **fields):
+        """Record a solver step (with the wall time since the previous step)"""
+        now = perf_counter()
+        seconds = now - (self._tstep if self._tstep is not None else now)
+        self._tstep = now
+        self.record('step', j=j, seconds=round(seconds, 6), **fields)
+
+    def reset_step(self):
+        """Start timing the next step"""
+        self._tstep = perf_counter()
+
+    @contextmanager
+    def hot(self):
+        """Profile the enclosed code with cProfile (if a profile output file is given)"""
+        prof = cProfile.Profile() if self.profile is not None else None
+        if prof is not None:
+            prof.enable()
+        try:
+            yield
+        finally:
+            if prof is not None:
+                prof.disable()
+                prof.dump_stats(self.profile)
+                stats = pstats.Stats(prof)
+                self.record('profile', path=str(self.profile), calls=stats.total_calls, seconds=round(stats.total_tt, 6))
+            if self.tracemalloc and self.enabled:
+                top = tm.take_snapshot().statistics('lineno')[:10]
+                self.record('allocations', top=[dict(line=str(s.traceback), size=s.size, count=s.count) for s in top])
+
+    def close(self, **fields):
+        """Write the final record and close the file"""
+        self.record('end', **fields)
+        if self.tracemalloc:
+            tm.stop()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.enabled = False
+
+
+def add_arguments(parser):
+    """Add the telemetry command line options to an argument parser"""
+    parser.add_argument("--telemetry", metavar="FILE", help="Stream telemetry records (JSON lines) to a file.")
+    parser.add_argument("--profile", metavar="FILE", help="Profile the solver loop with cProfile (pstats output file).")
+    parser.add_argument("--tracemalloc", action="store_true", help="Trace Python memory allocations (slow).")
+
+def from_args(args, **info):
+    """Telemetry object for the parsed command line options"""
+    return Telemetry(args.telemetry, args.profile, args.tracemalloc, **info)
+
+def summary(path):
+    """Summary of a telemetry file (phase durations, step statistics and peak memory)"""
+    with open(path) as f:
+        recs = [json.loads(line) for line in f if line.strip()]
+    steps = [r for r in recs if r['kind'] == 'step']
+    summ = {f"phase {r['name']}": r['seconds'] for r in recs if r['kind'] == 'phase'}
+    if steps:
+        summ['steps'] = len(steps)
+        summ['step seconds (mean)'] = sum(r['seconds'] for r in steps)/len(steps)
+        summ['step seconds (max)'] = max(r['seconds'] for r in steps)
+        for key in ('states', 'pruned', 'lookups'):
+            if key in steps[0]:
+                summ[f"{key} (total)"] = sum(r[key] for r in steps)
+    summ['peak rss (MB)'] = max(r['rss'] for r in recs)
+    if 'traced_peak' in recs[-1]:
+        summ['peak traced (MB)'] = max(r['traced_peak'] for r in recs)
+    summ['total seconds'] = recs[-1]['t']
+    return summ
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description="Summarize (and compare) solver telemetry files.")
+    parser.add_argument("files", nargs="+", help="Telemetry files (JSON lines).")
+    args = parser.parse_args()
+
+    summs = [summary(path) for path in args.files]
+    keys = list(dict.fromkeys(k for s in summs for k in s))
+    width = max(len(k) for k in keys)
+    print(f"{'':{width}s}  " + "  ".join(f"{Path(p).name[-14:]:>14s}" for p in args.files))
+    for k in keys:
+        print(f"{k:{width}s}  " + "  ".join(f"{s[k]:14.6g}" if k in s else f"{'-':>14s}" for s in summs))
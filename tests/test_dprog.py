@@ -0,0 +1,87 @@
+"""
+End-to-end tests of the dprog.py command line (short horizons).
+"""
+
+import subprocess
+import sys
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope="module")
+def workdir(tmp_path_factory):
+    """Working directory with prebuilt transition tables"""
+    sys.path.insert(0, str(REPO))
+    from trans import load_tables
+    path = tmp_path_factory.mktemp("dprog")
+    load_tables(path / "data")
+    return path
+
+def dprog(workdir, *args):
+    """Run dprog.py, returns the completed process"""
+    return subprocess.run([sys.executable, REPO / "dprog.py", *map(str, args)], cwd=workdir, capture_output=True, text=True)
+
+
+def test_offsets_unfinished(workdir):
+    # the races do not finish within 100 time steps
+    proc = dprog(workdir, "--offsets", "0-1", "--nsteps", 100, "--no-store")
+    assert proc.returncode == 0, proc.stderr
+    rows = proc.stdout[proc.stdout.index("ofs  steps"):].splitlines()[2:4]
+    assert [row.split()[0] for row in rows] == ["0", "1"]
+    assert all(row.split()[-1] == "-" for row in rows)
+
+def test_checkpoint_offsets_mismatch(workdir):
+    # a single offset checkpoint of the same sweep lacks the Q layers of the other start time steps
+    ck = workdir / "ck.npz"
+    proc = dprog(workdir, "--offset", 0, "--nsteps", 27, "--checkpoint", ck, "--checkpoint-interval", 0, "--no-store")
+    assert proc.returncode == 0, proc.stderr
+    proc = dprog(workdir, "--offsets", "0-7", "--nsteps", 20, "--checkpoint", ck, "--resume", "--no-store")
+    assert proc.returncode != 0
+    assert "does not match: offsets" in proc.stderr
+
+def test_output_matches_baseline(workdir):
+    # stdout of the original pure Python implementation (without progress and timing lines)
+    def table(out):
+        return [l for l in out.splitlines() if not l.startswith(("Frame ", "Solver finished:"))]
+    expected = (REPO / "tests" / "data" / "dprog012_ofs3.txt").read_text()
+    proc = dprog(workdir, "--nsteps", 12, "--offset", 3, "--no-store")
+    assert proc.returncode == 0, proc.stderr
+    assert table(proc.stdout) == table(expected)
+    # stored result
+    dprog(workdir, "--nsteps", 12, "--offset", 3)
+    proc = dprog(workdir, "--nsteps", 12, "--offset", 3)
+    assert proc.stdout.startswith("Loaded stored result")
+    assert table(proc.stdout)[1:] == table(expected)
+
+def test_resume_matches_uninterrupted(workdir):
+    def table(out):
+        return [l for l in out.splitlines() if not l.startswith(("Frame ", "Solver finished:", "Resuming "))]
+    args = ("--offset", 2, "--nsteps", 60, "--checkpoint-interval", 0, "--no-store")
+    proc = dprog(workdir, *args, "--policy", "full.npy", "--checkpoint", "full.npz")
+    assert proc.returncode == 0, proc.stderr
+    # interrupted run (killed in the middle of the backward sweep)
+    with subprocess.Popen([sys.executable, "-u", REPO / "dprog.py", *map(str, args), "--checkpoint", "ck.npz"],
+                          cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) as run:
+        for line in run.stdout:
+            if line.startswith("Frame 30 "):
+                run.kill()
+                break
+    assert run.returncode != 0
+    with np.load(workdir / "ck.npz") as c:
+        assert c['j'] > 1
+    proc2 = dprog(workdir, *args, "--policy", "resumed.npy", "--checkpoint", "ck.npz", "--resume")
+    assert proc2.returncode == 0, proc2.stderr
+    assert "Resuming at frame" in proc2.stdout
+    assert table(proc2.stdout) == table(proc.stdout)
+    # the policies and the last checkpoints (Q layer of time step 1) are identical
+    assert np.array_equal(np.load(workdir / "resumed.npy"), np.load(workdir / "full.npy"))
+    with np.load(workdir / "full.npz") as full, np.load(workdir / "ck.npz") as resumed:
+        assert int(resumed['j']) == int(full['j']) == 1
+        assert np.array_equal(resumed['Q'], full['Q'])
+        assert np.array_equal(resumed['P'], full['P'])
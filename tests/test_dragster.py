@@ -0,0 +1,40 @@
+"""
+Tests of the race web app simulation (re-simulation from checkpoints).
+"""
+
+import sys
+
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import dragster
+
+
+def default_model():
+    """Model of a new session (the race finishes in frame 493)"""
+    offset, maxframes, nskip = 0, 495, 140
+    uth = [0 if j-offset < 149 or j-offset in (173, 174, 195, 196, 197, 198, 229, 230, 449, 450, 465, 466, 481, 482) else 1 for j in range(maxframes)]
+    ucl = [1 if j-offset in (159, 160, 193, 194, 227, 228, 267, 268, 311, 312, 333, 334, 359, 360, 377, 378, 395, 396, 447, 448, 449, 450, 463, 464, 465, 466, 479, 480, 481, 482) else 0 for j in range(maxframes)]
+    return dragster.compute_model(offset, maxframes, nskip, uth, ucl)
+
+
+def test_update_near_end():
+    m = default_model()
+    assert m.states[-1].status == 0x0100
+    # releasing the throttle from frame 460 on: the race does not finish within the input frames
+    uth = [0 if t >= 460 else th for t, th in enumerate(m.uth)]
+    mnew = dragster.update_model(m._replace(uth=uth), 460)
+    states, _ = dragster.resimulate(m.offset, m.nskip, uth, m.ucl)
+    assert mnew.states[-1].status == 0
+    assert mnew.states[-1].frame == len(uth)-1
+    assert np.array_equal(mnew.states.data, states.data)
+    # clutch toggles near the end
+    for t in (455, 469, 485):
+        ucl = list(m.ucl)
+        ucl[t] = 1-ucl[t]
+        mnew = dragster.update_model(m._replace(ucl=ucl), t)
+        states, _ = dragster.resimulate(m.offset, m.nskip, m.uth, ucl)
+        assert np.array_equal(mnew.states.data, states.data)
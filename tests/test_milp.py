@@ -0,0 +1,39 @@
+"""
+Smoke tests of the MILP solver backends (skipped if a backend is not installed).
+"""
+
+import importlib.util
+import shutil
+import sys
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import milp
+
+
+def knapsack():
+    """Tiny model: max 5 x0 + 4 x1 + 3 x2 + 2 y, 2 x0 + 3 x1 + x2 + y <= 5, x binary, 0 <= y <= 3 integer"""
+    mod = milp.Model("knapsack", milp.MAXIMIZE)
+    x = mod.add_vars(3, milp.BINARY, obj=[5, 4, 3], name="x")
+    y = mod.add_vars(1, milp.INTEGER, ub=3, obj=2, name="y")
+    mod.add_constrs((2*x[0:1]+3*x[1:2]+x[2:3]+y) <= 5, "cap")
+    return mod
+
+
+@pytest.mark.parametrize("solver", [
+    "highs",
+    pytest.param("cbc", marks=pytest.mark.skipif(shutil.which("cbc") is None, reason="cbc not installed")),
+    pytest.param("gurobi", marks=pytest.mark.skipif(importlib.util.find_spec("gurobipy") is None, reason="gurobipy not installed")),
+])
+def test_solve(solver):
+    mod = knapsack()
+    sol = milp.solve(mod, solver, verbose=False)
+    assert sol.status == milp.OPTIMAL
+    assert sol.objective == pytest.approx(12)
+    assert np.round(sol.x).tolist() == [1, 0, 1, 2]
+    assert mod.violations(sol.x) == (0, 0)
@@ -0,0 +1,46 @@
+"""
+Tests of the optim.py command line (model export only, no solver runs).
+"""
+
+import subprocess
+import sys
+
+from pathlib import Path
+
+import pytest
+
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope="module")
+def dprog_script(tmp_path_factory):
+    """Stella script of a full-race dprog.py solution (offset 0)"""
+    sys.path.insert(0, str(REPO))
+    from trans import load_tables
+    path = tmp_path_factory.mktemp("optim")
+    load_tables(path / "data")
+    proc = subprocess.run([sys.executable, REPO / "dprog.py", *map(str, ("--nsteps", 168, "--offset", 0, "--save", "--no-store"))],
+                          cwd=path, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    return path / "scripts" / "dprog168_ofs0.script"
+
+def optim(workdir, *args):
+    """Run optim.py, returns the completed process"""
+    return subprocess.run([sys.executable, REPO / "optim.py", *map(str, args)], cwd=workdir, capture_output=True, text=True)
+
+
+def test_init_offset(tmp_path):
+    script = REPO / "scripts" / "demo_ofs2.script"
+    proc = optim(tmp_path, "--nsteps", 60, "--offset", 1, "--init", script, "--write", tmp_path / "model.lp")
+    assert proc.returncode == 0, proc.stderr
+    assert "Warm start:" in proc.stdout
+    proc = optim(tmp_path, "--nsteps", 60, "--offset", 0, "--init", script, "--write", tmp_path / "model.lp")
+    assert proc.returncode != 0
+    assert "starts at offset 1 (expected --offset 0)" in proc.stderr
+
+def test_init_dprog_feasible(tmp_path, dprog_script):
+    # the speed reaches 253 (one above the largest reference speed) near the finish
+    proc = optim(tmp_path, "--nsteps", 177, "--offset", 0, "--init", dprog_script, "--write", tmp_path / "model.lp")
+    assert proc.returncode == 0, proc.stderr
+    assert "Warm start: 0 bounds and 0 constraints violated" in proc.stdout
@@ -0,0 +1,73 @@
+"""
+Tests of the simulator and the dump parser.
+"""
+
+import sys
+
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bench
+import sim
+
+
+def check_dump(path):
+    """Compare read_dump() with the tokens of every frame"""
+    ram, io = sim.read_dump(path)
+    lines = [l.split() for l in path.read_text().splitlines()]
+    frames = [lines[k:k+sim.DUMP_LINES] for k in range(0, len(lines), sim.DUMP_LINES)]
+    assert ram.tolist() == [[int(f[row][col], 16) for row in range(8) for col in sim.DUMP_RAM_COLS] for f in frames]
+    assert io.tolist() == [[int(f[row][col], 16) for row, col in sim.DUMP_IO_TOKENS] for f in frames]
+
+def test_read_dump(tmp_path):
+    path = tmp_path / "test.dump"
+    bench.write_dump(path, 50, np.random.default_rng(bench.SEED))
+    check_dump(path)
+
+def test_read_dump_varying_lines(tmp_path):
+    path = tmp_path / "test.dump"
+    bench.write_dump(path, 20, np.random.default_rng(bench.SEED))
+    lines = path.read_text().splitlines()
+    # other whitespace in some lines of later frames (decoded token by token)
+    lines[3*sim.DUMP_LINES+2] = lines[3*sim.DUMP_LINES+2].replace(" ", "  ")
+    lines[7*sim.DUMP_LINES+9] = "\t".join(lines[7*sim.DUMP_LINES+9].split())
+    path.write_text("\n".join(lines) + "\n")
+    check_dump(path)
+
+def test_read_dump_truncated(tmp_path):
+    path = tmp_path / "test.dump"
+    bench.write_dump(path, 3, np.random.default_rng(bench.SEED))
+    path.write_bytes(path.read_bytes()[:-100])
+    with pytest.raises(ValueError, match="Truncated"):
+        sim.read_dump(path)
+
+def test_sim_batch_short_inputs():
+    with pytest.raises(ValueError, match="before the race starts"):
+        sim.sim_batch(np.zeros((3, 5, 2)), offset=8)
+    # the inputs end right after the pre-race frames (as sim() stops at the end of the inputs)
+    res = sim.sim_batch(np.zeros((3, 10, 2)), offset=8)
+    assert (res.end == sim.RUNNING).all()
+
+@pytest.mark.parametrize("offset", [0, 2])
+def test_sim_batch_lanes(offset):
+    with open(Path(sim.__file__).parent / "scripts" / f"demo_ofs{offset:X}.script") as script:
+        inputs, _ = sim.read_script(script)
+    race = inputs[1:, :2].astype(np.int32)
+    busted = np.ones_like(race)  # full throttle in gear N
+    unfinished = race.copy()
+    unfinished[300:, 0] = 0  # throttle released
+    lanes = np.stack([race, busted, unfinished])
+    res = sim.sim_batch(lanes, offset, traces=True)
+    assert res.end.tolist() == [sim.FINISHED, sim.BUSTED, sim.RUNNING]
+    for k, lane in enumerate(lanes):
+        # sim() stops at the end of the inputs (after yielding the state of the last input frame)
+        trace = sim.Trace.from_states(islice(sim.sim(iter(lane.tolist()), offset), len(lane)+1))
+        n = len(trace)
+        assert trace.data.tolist() == [res.traces[f][k, :n].tolist() for f in sim.FrameState._fields]
+        assert (res.traces['frame'][k, n:] == -1).all()
+        assert (res.frame[k], res.status[k], res.x[k], res.v[k]) == (trace.frame[-1], trace.status[-1], trace.x[-1], trace.v[-1])
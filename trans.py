@@ -0,0 +1,153 @@
+"""
+Dragster state space and precomputed state transition tables.
+
+The dynamics only depend on time through `frame & rpm_skip[k]`. Since the
+masks are nested (0x02, 0x06, 0x0E), the frame number enters the transition
+map only through its phase, i.e. the number of masks that are passed by the
+frame. Hence, there are just four distinct transition maps (per input) over
+the whole state space. These are computed once and stored in a `.npy` file
+that can be memory-mapped by any solver.
+"""
+
+from itertools import product
+from pathlib import Path
+
+import numpy as np
+
+
+m = 2*5*32*254+1  # size of state space (including 'busted' sink state m-1)
+
+#
+# dragster state x
+#   x[0]: clutch (c = 0..1)
+#   x[1]: gear (y = 0..4)
+#   x[2]: motor speed (r = 0..31)
+#   x[3]: dragster speed (v = 0..253)
+#
+# user inputs u
+#   u[0]: throttle
+#   u[1]: clutch
+#
+# inputs are encoded as a = 2*th + cl, i.e. in the order of product(range(2), range(2))
+#
+inputs = list(product(range(2), range(2)))
+
+# motor speed update masks and increments (per effective gear)
+rpm_skip = (0x00, 0x00, 0x02, 0x06, 0x0E)
+rpm_incr = (3, 1, 1, 1, 1)
+
+# transition tables version (increment on any change of the physics below)
+VERSION = 1
+
+# representative frame numbers for the four phases
+PHASE_FRAMES = (3, 5, 9, 1)
+
+
+def idx(x):
+    """Computes linearized index for system state x"""
+    return (((x[0]*5 + x[1])*32 + x[2])*254 + x[3]) if x else m-1
+
+def frm(j, ofs):
+    """Compute frame number from time step"""
+    return 159 + 2*(j+ofs)
+
+def stp(frame, ofs):
+    """Compute time step from frame number"""
+    return (frame-159)//2 - ofs
+
+def phase(frame):
+    """Compute transition table phase (0..3) of frame number"""
+    return sum(frame & mask == 0 for mask in rpm_skip[2:])
+
+def nxt(j, ofs, u, x):
+    """Computes x[j+1] = f(u[j],x[j])"""
+    # unpack variables
+    c, y, r, v = x
+    th, cl = u
+    # motor speed (r)
+    k = (1-c)*y
+    if frm(j, ofs) & rpm_skip[k] == 0:
+        r = max(r + (2*th-1)*rpm_incr[k], 0)
+    if r > 31:
+        return None
+    # dragster speed (v)
+    if y > 0 and c == 0:
+        vref = ((1 << y) >> 1)*r + ((1 << y) >> 2)*(r >= 20)
+        if vref < v:
+            v -= 1
+        elif vref > v:
+            if vref >= v + 16:
+                r -= 1
+            v += 2
+    # gear (y)
+    if cl == 0 and c == 1:
+        y = min(y+1, 4)
+    # clutch (c)
+    c = cl
+    return c, y, r, v
+
+def nxtv(frame, u, x):
+    """Computes idx(f(u,x)) in frame for arrays of states x"""
+    # unpack variables
+    c, y, r, v = x
+    th, cl = u
+    # motor speed (r)
+    k = (1-c)*y
+    r = np.where(frame & np.array(rpm_skip)[k] == 0, np.maximum(r + (2*th-1)*np.array(rpm_incr)[k], 0), r)
+    busted = r > 31
+    # dragster speed (v)
+    vref = ((1 << y) >> 1)*r + ((1 << y) >> 2)*(r >= 20)
+    drive = (y > 0) & (c == 0)
+    vdec = drive & (vref < v)
+    vinc = drive & (vref > v)
+    r = r - (vinc & (vref >= v + 16))
+    v = v - vdec + 2*vinc
+    # gear (y)
+    if cl == 0:
+        y = np.where(c == 1, np.minimum(y+1, 4), y)
+    # clutch (c)
+    c = cl
+    return np.where(busted, m-1, ((c*5 + y)*32 + r)*254 + v).astype(np.int32)
+
+def states():
+    """All (non-sink) states as arrays (c, y, r, v) in index order"""
+    return np.unravel_index(np.arange(m-1, dtype=np.int32), (2, 5, 32, 254))
+
+def build_tables():
+    """Computes transition tables T[phase, a, i] = idx(f(inputs[a], x_i))"""
+    x = states()
+    T = np.full((len(PHASE_FRAMES), len(inputs), m), m-1, dtype=np.int32)
+    for p, frame in enumerate(PHASE_FRAMES):
+        for a, ua in enumerate(inputs):
+            T[p, a, :m-1] = nxtv(frame, ua, x)
+    return T
+
+def tables_path(datadir='data'):
+    return Path(datadir) / f"trans_v{VERSION}.npy"
+
+def load_tables(datadir='data'):
+    """Load (memory-mapped) transition tables, build and save them if necessary"""
+    path = tables_path(datadir)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp.npy')
+        np.save(tmp, build_tables())
+        tmp.replace(path)
+    return np.load(path, mmap_mode='r')
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from time import perf_counter
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description="Build Dragster state transition tables.")
+    parser.add_argument("--datadir", default="data", help="Output directory.")
+    args = parser.parse_args()
+
+    tbeg = perf_counter()
+    path = tables_path(args.datadir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.save(path, build_tables())
+    print(f"Wrote transition tables '{path}' ({perf_counter()-tbeg:.3f}s).")
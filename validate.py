@@ -0,0 +1,135 @@
+"""
+Bulk validation of the simulator against Stella dumps.
+
+A run consists of a debug script `<scripts>/<runid>.script` (see
+`sim.write_script`) and its dump `<datadir>/<romname>_dbg_<runid>.dump`. The
+inputs, start offset and captured frames are read back from the script, the
+run is re-simulated and the compared fields are diffed as whole arrays.
+"""
+
+import argparse
+import os
+import sys
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from pathlib import Path
+
+from sim import FrameState, Trace, sim, read_script, dump_path, parse_dump
+
+import numpy as np
+
+
+# compared frame state fields
+FIELDS = ['status', 'countdown', 'time', 'x', 'v', 'y', 'r', 'th']
+
+# Divergence record
+#   frame:     first diverging frame
+#   sim:       simulated value
+#   dump:      emulator value
+#   count:     number of diverging frames
+Divergence = namedtuple('Divergence', ['frame', 'sim', 'dump', 'count'])
+
+# RunResult record
+#   runid:     run identifier
+#   offset:    start frame offset
+#   frames:    number of captured frames (according to the script)
+#   dumped:    number of dumped frames
+#   error:     error message (or None)
+#   diffs:     dict of Divergence per diverging field
+RunResult = namedtuple('RunResult', ['runid', 'offset', 'frames', 'dumped', 'error', 'diffs'])
+
+
+def validate(runid, romname, scripts='scripts', datadir='data', fields=FIELDS):
+    """Compare the simulation of a run with its Stella dump."""
+
+    with open(Path(scripts) / f"{runid}.script") as script:
+        inputs, frames = read_script(script)
+    restart = np.flatnonzero(inputs[:, 2])
+    if len(restart) == 0:
+        return RunResult(runid, None, len(frames), 0, "no game start in script", {})
+    offset = int(restart[0]) - 1
+    if not dump_path(romname, runid, datadir).exists():
+        return RunResult(runid, offset, len(frames), 0, "dump not found", {})
+
+    # simulate all frames of the script, select captured frames
+    ingen = ((int(th), int(cl)) for th, cl, _ in inputs[1:])
+    states = Trace.from_states(islice(sim(ingen, offset), len(inputs))).to_numpy()
+    frames = np.array(frames, dtype=np.int64)
+    if len(frames) > 0 and frames[-1] >= len(states['frame']):
+        return RunResult(runid, offset, len(frames), 0, f"simulation ended at frame {len(states['frame'])-1}", {})
+    dense = np.array_equal(frames, np.arange(len(inputs)))
+    try:
+        dump = parse_dump(romname, runid, frames=None if dense else frames, datadir=datadir).to_numpy()
+    except ValueError as e:
+        return RunResult(runid, offset, len(frames), 0, str(e), {})
+
+    # compare common frames
+    n = min(len(frames), len(dump['frame']))
+    diffs = {}
+    for f in fields:
+        ss = states[f][frames[:n]]
+        sd = dump[f][:n]
+        d = np.flatnonzero(ss != sd)
+        if len(d) > 0:
+            diffs[f] = Divergence(frame=int(states['frame'][frames[d[0]]]), sim=int(ss[d[0]]), dump=int(sd[d[0]]), count=len(d))
+    error = None if n == len(frames) == len(dump['frame']) else f"{len(dump['frame'])} dumped frames, expected {len(frames)}"
+    return RunResult(runid, offset, len(frames), len(dump['frame']), error, diffs)
+
+
+def runids(scripts, patterns):
+    """Identifiers of all runs in the scripts directory matching any of the patterns"""
+    return sorted({p.name[:-len('.script')] for pattern in patterns for p in Path(scripts).glob(f"{pattern}.script")})
+
+
+if __name__ == "__main__":
+
+    from time import perf_counter
+
+    # parse arguments
+    parser = argparse.ArgumentParser(description="Validate the simulator against Stella dumps.")
+    parser.add_argument("patterns", nargs="*", default=["demo_ofs*", "dprog*", "mintime*", "opt*"], help="Run identifier patterns.")
+    parser.add_argument("--romname", default="Dragster (1980) (Activision)", help="The name of the ROM file.")
+    parser.add_argument("--scripts", default="scripts", help="Directory of Stella debug scripts.")
+    parser.add_argument("--datadir", default="data", help="Directory of Stella dumps.")
+    parser.add_argument("--fields", default=",".join(FIELDS), help="Compared fields (comma separated).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes.")
+    args = parser.parse_args()
+    fields = args.fields.split(",")
+    for f in fields:
+        if f not in FrameState._fields:
+            parser.error(f"unknown field '{f}'")
+
+    tbeg = perf_counter()
+    ids = runids(args.scripts, args.patterns)
+    with ProcessPoolExecutor(args.workers) as executor:
+        results = list(executor.map(partial(validate, romname=args.romname, scripts=args.scripts, datadir=args.datadir, fields=fields), ids))
+
+    # summary table
+    width = max([len(r.runid) for r in results] + [3])
+    print(f"{'run':{width}s}  ofs  frames  dumped  result  first  fields")
+    print("-"*(width+46))
+    for r in results:
+        result = 'ERROR' if r.error else 'FAIL' if r.diffs else 'ok'
+        first = min((d.frame for d in r.diffs.values()), default=None)
+        print(f"{r.runid:{width}s}  {'-' if r.offset is None else r.offset:>3}  {r.frames:6d}  {r.dumped:6d}  {result:6s}  "
+              f"{'-' if first is None else first:>5}  {' '.join(r.diffs)}".rstrip())
+
+    # first divergence per field
+    if any(r.diffs for r in results):
+        print()
+        print(f"{'run':{width}s}  field      frame    sim   dump  count")
+        print("-"*(width+41))
+        for r in results:
+            for f, d in r.diffs.items():
+                print(f"{r.runid:{width}s}  {f:9s}  {d.frame:5d}  {d.sim:5d}  {d.dump:5d}  {d.count:5d}")
+    for r in results:
+        if r.error:
+            print(f"{r.runid}: {r.error}")
+
+    print()
+    nfail = sum(1 for r in results if r.error or r.diffs)
+    print(f"Validated {len(results)} runs ({nfail} failed) in {perf_counter()-tbeg:.2f}s.")
+    sys.exit(1 if nfail > 0 else 0)